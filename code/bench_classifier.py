@@ -0,0 +1,72 @@
+# Compare the single pass terrain classifier against the original chain of cv2 calls
+# Run it from the code folder: python bench_classifier.py
+import argparse
+import glob
+import os
+import time
+import numpy as np
+import cv2
+from PIL import Image
+
+from perception import PerceptionContext
+
+
+# This is how perception_step used to classify the warped image
+def classify_cv2(masked_data, vision_image):
+    rgb_thresh = (160, 160, 160)
+    nav_select = cv2.inRange(masked_data, rgb_thresh, (255, 255, 255))
+    hsv_low_thresh = (20, 100, 100)
+    hsv_high_thresh = (30, 255, 255)
+    hsv_img = cv2.cvtColor(masked_data, cv2.COLOR_RGB2HSV)
+    sample_select = cv2.inRange(hsv_img, hsv_low_thresh, hsv_high_thresh)
+    obstacle_select = cv2.bitwise_not(cv2.bitwise_or(nav_select, sample_select))
+    vision_image[:, :, 0] = obstacle_select
+    vision_image[:, :, 1] = sample_select
+    vision_image[:, :, 2] = nav_select
+    return vision_image
+
+
+def classify_lut(context, masked_data, vision_image):
+    classes = context.classify(masked_data)
+    return cv2.merge(context.class_masks(classes), dst=vision_image)
+
+
+def time_per_frame(function, frames, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for frame in frames:
+            function(frame)
+    return (time.perf_counter() - start) / (repeat * len(frames))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Terrain classifier benchmark')
+    parser.add_argument('image_folder', type=str, nargs='?', default='../test_dataset/IMG',
+                        help='Folder with the camera images to classify.')
+    parser.add_argument('--repeat', type=int, default=5, help='Passes over the whole folder.')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    context = PerceptionContext()
+    print('Context built in {:.3f} s'.format(time.perf_counter() - start))
+    # Warp everything up front, only classification is timed.
+    # The classifier reads the 4 channel warp, the cv2 chain the same pixels without alpha
+    warped = [context.warp(np.asarray(Image.open(path))).copy()
+              for path in sorted(glob.glob(os.path.join(args.image_folder, '*.jpg')))]
+    frames = [(frame, np.ascontiguousarray(frame[:, :, :3])) for frame in warped]
+    print('Loaded {} frames'.format(len(frames)))
+
+    reference = np.zeros(warped[0].shape[:2] + (3,), np.uint8)
+    candidate = np.zeros(warped[0].shape[:2] + (3,), np.uint8)
+    mismatches = 0
+    for rgba, rgb in frames:
+        classify_cv2(rgb, reference)
+        classify_lut(context, rgba, candidate)
+        mismatches += np.count_nonzero(reference != candidate)
+    print('Mismatched mask pixels: {}'.format(mismatches))
+
+    cv2_time = time_per_frame(lambda frame: classify_cv2(frame[1], reference), frames, args.repeat)
+    lut_time = time_per_frame(lambda frame: classify_lut(context, frame[0], candidate), frames, args.repeat)
+    print('cv2 chain:  {:.3f} ms/frame'.format(1000 * cv2_time))
+    print('lookup table: {:.3f} ms/frame'.format(1000 * lut_time))
+    print('speedup: {:.2f}x'.format(cv2_time / lut_time))
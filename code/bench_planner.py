@@ -0,0 +1,66 @@
+# Time the grid path planner replanning the way back home on every frame of a recorded run.
+# The worldmap grows frame by frame as perception maps the run, and each replan is timed
+# both incrementally (D* Lite repairing the previous search) and from scratch.
+# Run it from the code folder: python bench_planner.py
+import argparse
+import time
+import numpy as np
+
+from perception import perception_step
+from planner import GridPlanner
+from rover_state import RoverState
+from replay import load_run, update_rover_from_log
+
+
+# Path to the goal, searching again until the planner is done. Returns (path, seconds)
+def timed_path(planner, start, goal):
+    begin = time.perf_counter()
+    path = None
+    while path is None:
+        path = planner.path(start[0], start[1], goal[0], goal[1])
+    return path, time.perf_counter() - begin
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Path planner benchmark')
+    parser.add_argument('log', type=str, nargs='?', default='../test_dataset/robot_log.csv',
+                        help='Path to robot_log.csv or to a recording folder written by '
+                             'drive_rover.py --record_format chunks.')
+    parser.add_argument('--every', type=int, default=1, help='Replan every this many frames.')
+    args = parser.parse_args()
+
+    frames, images = load_run(args.log)
+    start_time = float(frames[0]['Time'])
+
+    Rover = RoverState()
+    Rover.samples_pos = (np.int_([]), np.int_([]))
+    incremental_times = []
+    scratch_times = []
+    mismatches = 0
+    for index, (row, img) in enumerate(zip(frames, images)):
+        Rover = update_rover_from_log(Rover, row, img, start_time)
+        Rover = perception_step(Rover)
+        if index % args.every:
+            continue
+        # Rover.paths is kept up to date by perception_step, so only the search is timed
+        path, seconds = timed_path(Rover.paths, Rover.pos, Rover.home)
+        incremental_times.append(seconds)
+        # The same plan from scratch, on a planner that sees the whole map at once
+        scratch = GridPlanner(Rover.worldmap.shape[0])
+        scratch.update(Rover.worldmap, np.arange(Rover.worldmap.shape[0] * Rover.worldmap.shape[1]))
+        scratch_path, seconds = timed_path(scratch, Rover.pos, Rover.home)
+        scratch_times.append(seconds)
+        # Both must find paths of the same cost (ties may be broken differently)
+        goal = Rover.paths.cell(*Rover.home)
+        cost = Rover.paths.planners[goal].g[path[0]]
+        scratch_cost = scratch.planners[goal].g[scratch_path[0]]
+        mismatches += not np.isclose(cost, scratch_cost)
+
+    incremental_times = np.array(incremental_times)
+    scratch_times = np.array(scratch_times)
+    print('{} replans over {} frames, {} with a different path cost'.format(
+        len(incremental_times), len(frames), mismatches))
+    for name, times in (('incremental', incremental_times), ('from scratch', scratch_times)):
+        print('{:<13} mean {:7.2f} ms  p95 {:7.2f} ms  max {:7.2f} ms'.format(
+            name, 1000 * times.mean(), 1000 * np.percentile(times, 95), 1000 * times.max()))
+    print('speedup: {:.1f}x'.format(scratch_times.mean() / incremental_times.mean()))
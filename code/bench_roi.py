@@ -0,0 +1,67 @@
+# Compare perception on the region of interest only (the default) against warping and classifying
+# the whole camera image: the masks must be identical, with less pixel work per frame.
+# Run it from the code folder: python bench_roi.py
+import argparse
+import glob
+import os
+import time
+import numpy as np
+from PIL import Image
+
+from perception import PerceptionContext
+
+
+# Obstacle, sample and navigable masks of a camera image, and the world cells of its pixels,
+# as perception_step computes them
+def vision_step(context, img):
+    masked_data = context.warp(img)
+    classes = context.classify(masked_data)
+    obstacle_select, sample_select, nav_select = context.class_masks(classes)
+    context.mask_unseen(masked_data, obstacle_select)
+    context.world_cells(100.0, 100.0, 45.0)
+    return obstacle_select, sample_select, nav_select
+
+
+def time_per_frame(context, images, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for img in images:
+            vision_step(context, img)
+    return (time.perf_counter() - start) / (repeat * len(images))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Region of interest benchmark')
+    parser.add_argument('image_folder', type=str, nargs='?', default='../test_dataset/IMG',
+                        help='Folder with the camera images to process.')
+    parser.add_argument('--repeat', type=int, default=5, help='Passes over the whole folder.')
+    args = parser.parse_args()
+
+    images = [np.asarray(Image.open(path)) for path in sorted(glob.glob(os.path.join(args.image_folder, '*.jpg')))]
+    print('Loaded {} frames'.format(len(images)))
+    full = PerceptionContext(images[0].shape, crop=False)
+    cropped = PerceptionContext(images[0].shape)
+
+    # Masks of the region of interest, put back in place in the whole image, must be the same
+    mismatches = 0
+    canvas = np.zeros(images[0].shape[:2], np.uint8)
+    for img in images:
+        for full_select, cropped_select in zip(vision_step(full, img), vision_step(cropped, img)):
+            canvas[:] = 0
+            canvas[cropped.roi] = cropped_select
+            mismatches += np.count_nonzero(canvas != full_select)
+    print('Mismatched mask pixels: {}'.format(mismatches))
+    # Pixels with camera data must have the same rover-centric coordinates
+    same_view = (np.array_equal(full.dists[full.view_pixels], cropped.dists[cropped.view_pixels])
+                 and np.array_equal(full.angles[full.view_pixels], cropped.angles[cropped.view_pixels]))
+    print('Same pixels in view: {}'.format(same_view))
+
+    for name, context in (('whole image', full), ('region of interest', cropped)):
+        print('{:<18}  source {}x{} ({} px), warped and classified {}x{} ({} px)'.format(
+            name, context.rgba.shape[1], context.rgba.shape[0], context.rgba.shape[0] * context.rgba.shape[1],
+            context.warped.shape[1], context.warped.shape[0], context.warped.shape[0] * context.warped.shape[1]))
+    full_time = time_per_frame(full, images, args.repeat)
+    cropped_time = time_per_frame(cropped, images, args.repeat)
+    print('whole image:        {:.3f} ms/frame'.format(1000 * full_time))
+    print('region of interest: {:.3f} ms/frame'.format(1000 * cropped_time))
+    print('speedup: {:.2f}x'.format(full_time / cropped_time))
@@ -0,0 +1,222 @@
+# Regression and throughput suite for the perception pipeline over a recorded run.
+# Runs the notebook functions (perspect_transform, color_thresh, rover_coords, pix_to_world) and
+# the rover pipeline (perception_step, decision_step, create_output_images) on every frame, times
+# every function, and compares what they produce against golden outputs saved from a previous run.
+#   python bench_suite.py --save              save the golden outputs of the current code
+#   python bench_suite.py --results out.json  compare against them and write the timings and checks
+# The golden outputs of test_dataset are committed in output/golden.npz. Its 'sources' entry records
+# the tree each output was produced by: the notebook functions and the perception masks come from the
+# original code, the map, the decisions and the inset images (which changed on purpose since) from the
+# tree that last changed them.
+# Exits with status 1 when a check fails or there are no golden outputs to compare against,
+# so it can gate changes on both correctness and speed
+import argparse
+import base64
+import json
+import os
+import numpy as np
+import cv2
+
+from perception import perception_step, perspect_transform, color_thresh, rover_coords, pix_to_world
+from decision import decision_step
+from supporting_functions import create_output_images
+from rover_state import RoverState
+from instrumentation import PipelineStats
+from replay import load_run, update_rover_from_log
+
+# How each golden output is compared: (measure, tolerance name). Measures are
+#   mask      fraction of mask pixels that differ
+#   map       fraction of worldmap cells that differ
+#   relative  largest difference relative to the golden value (at least 1)
+#   absolute  largest absolute difference
+CHECKS = {
+    'perspect_transform': ('absolute', 'image'),  # mean of each warped image channel
+    'color_thresh': ('mask', 'mask'),
+    'rover_coords': ('relative', 'value'),  # number of pixels and sums of their coordinates
+    'pix_to_world': ('relative', 'value'),
+    # perception_step sample and navigable masks (Rover.vision_image). The obstacle mask is left out,
+    # it only covers the pixels in view since the original code
+    'vision': ('mask', 'view'),
+    'nav_pixels': ('relative', 'count'),
+    'worldmap': ('map', 'map'),
+    'mapped': ('absolute', 'metric'),  # % of map_bw.png mapped, and fidelity
+    'fidelity': ('absolute', 'metric'),
+    'commands': ('absolute', 'command'),  # decision_step throttle, brake and steer
+    'output_images': ('absolute', 'image'),  # mean of the decoded inset images
+}
+
+# The perception masks are warped with cv2.remap, which rounds a few pixels at the edges of the
+# masks differently from cv2.warpPerspective in the original code
+TOLERANCES = {'mask': 0.0, 'view': 1e-5, 'count': 1e-3, 'map': 0.0, 'value': 1e-9, 'metric': 0.0,
+              'command': 1e-9, 'image': 0.5}
+
+
+# Mean gray level of a base64 JPEG inset image
+def image_mean(image_string):
+    return cv2.imdecode(np.frombuffer(base64.b64decode(image_string), np.uint8), cv2.IMREAD_UNCHANGED).mean()
+
+
+# Run every function on every frame, timing each one as a stage of stats.
+# Returns the outputs of the run (see CHECKS)
+def run_suite(frames, images, stats):
+    Rover = RoverState()
+    # There are no sample positions in a training log
+    Rover.samples_pos = (np.int_([]), np.int_([]))
+    context = Rover.perception_context
+    world_size = Rover.worldmap.shape[0]
+    start_time = float(frames[0]['Time'])
+    outputs = {name: [] for name in CHECKS if name not in ('worldmap', 'mapped', 'fidelity')}
+    for row, img in zip(frames, images):
+        # The notebook functions, one after the other as in the notebook
+        with stats.stage('perspect_transform'):
+            warped = perspect_transform(img, context.source, context.destination)
+        with stats.stage('color_thresh'):
+            threshed = color_thresh(warped)
+        with stats.stage('rover_coords'):
+            xpix, ypix = rover_coords(threshed)
+        with stats.stage('pix_to_world'):
+            x_world, y_world = pix_to_world(xpix, ypix, float(row['X_Position']), float(row['Y_Position']),
+                                            float(row['Yaw']), world_size, context.scale)
+        outputs['perspect_transform'].append(warped.reshape(-1, 3).mean(axis=0))
+        outputs['color_thresh'].append(np.packbits(threshed.ravel() > 0))
+        outputs['rover_coords'].append((len(xpix), xpix.sum(), ypix.sum()))
+        outputs['pix_to_world'].append((len(x_world), x_world.sum(), y_world.sum()))
+
+        # The rover pipeline
+        Rover = update_rover_from_log(Rover, row, img, start_time)
+        with stats.stage('perception_step'):
+            Rover = perception_step(Rover)
+        with stats.stage('decision_step'):
+            Rover = decision_step(Rover)
+        with stats.stage('create_output_images'):
+            output_images = create_output_images(Rover)
+        outputs['vision'].append(np.packbits(Rover.vision_image[:, :, 1:].ravel() > 0))
+        outputs['nav_pixels'].append(len(Rover.nav_dists))
+        outputs['commands'].append((Rover.throttle, Rover.brake, Rover.steer))
+        outputs['output_images'].append([image_mean(image) for image in output_images])
+    outputs = {name: np.array(values) for name, values in outputs.items()}
+    outputs['worldmap'] = Rover.worldmap.copy()
+    outputs['mapped'] = np.array(Rover.map_stats.perc_mapped())
+    outputs['fidelity'] = np.array(Rover.map_stats.fidelity())
+    return outputs
+
+
+# Difference between an output and its golden value, as measured for that output (see CHECKS)
+def difference(measure, value, golden):
+    if value.shape != golden.shape:
+        return np.inf
+    if measure == 'mask':
+        return np.unpackbits(value ^ golden).mean() if value.size else 0.0
+    if measure == 'map':
+        return np.mean(np.any(value != golden, axis=-1))
+    difference = np.abs(value.astype(np.float64) - golden)
+    if measure == 'relative':
+        difference = difference / np.maximum(np.abs(golden), 1)
+    return float(difference.max()) if difference.size else 0.0
+
+
+# Check every output against its golden value. Returns one result per output
+def compare(outputs, golden, tolerances):
+    results = []
+    for name, (measure, tolerance_name) in CHECKS.items():
+        tolerance = tolerances[tolerance_name]
+        if name not in golden:
+            results.append({'output': name, 'measure': measure, 'difference': None,
+                            'tolerance': tolerance, 'passed': False})
+            continue
+        value = float(difference(measure, outputs[name], golden[name]))
+        results.append({'output': name, 'measure': measure, 'difference': value,
+                        'tolerance': tolerance, 'passed': value <= tolerance})
+    return results
+
+
+# Compare the mean time of every function against a previous results file.
+# A function fails if it got more than max_slowdown times slower
+def compare_speed(throughput, baseline, max_slowdown):
+    results = []
+    for name, timing in throughput.items():
+        if name not in baseline:
+            continue
+        ratio = timing['mean_ms'] / baseline[name]['mean_ms']
+        results.append({'function': name, 'mean_ms': timing['mean_ms'], 'baseline_mean_ms': baseline[name]['mean_ms'],
+                        'ratio': ratio, 'passed': ratio <= max_slowdown})
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Perception regression and throughput suite')
+    parser.add_argument('log', type=str, nargs='?', default='../test_dataset/robot_log.csv',
+                        help='Path to robot_log.csv or to a recording folder written by '
+                             'drive_rover.py --record_format chunks.')
+    parser.add_argument('--golden', type=str, default='../output/golden.npz', help='Golden outputs file.')
+    parser.add_argument('--save', action='store_true', help='Save the outputs of this run as the golden outputs.')
+    parser.add_argument('--source', type=str, default='working tree',
+                        help='With --save, the tree the golden outputs are recorded as coming from.')
+    parser.add_argument('--results', type=str, default='',
+                        help='Write the throughput of every function and the checks to this JSON file.')
+    parser.add_argument('--repeat', type=int, default=1, help='Passes over the run (timings cover all of them).')
+    parser.add_argument('--baseline', type=str, default='',
+                        help='Results file of a previous run: fail if a function got slower than max_slowdown times.')
+    parser.add_argument('--max_slowdown', type=float, default=1.2)
+    for name, tolerance in TOLERANCES.items():
+        parser.add_argument('--{}_tolerance'.format(name), type=float, default=tolerance)
+    args = parser.parse_args()
+
+    frames, images = load_run(args.log)
+    print('Loaded {} frames'.format(len(frames)))
+    stats = PipelineStats()
+    for _ in range(args.repeat):
+        outputs = run_suite(frames, images, stats)
+
+    summary = stats.summary()
+    throughput = {}
+    for name, timing in summary['stages'].items():
+        throughput[name] = dict(timing, calls_per_s=1000 / timing['mean_ms'] if timing['mean_ms'] else 0.0)
+        print('{:<21} {:9.1f} calls/s  mean {:7.3f} ms  p95 {:7.3f} ms'.format(
+            name, throughput[name]['calls_per_s'], timing['mean_ms'], timing['p95_ms']))
+    print('Mapped: {}%  Fidelity: {}%'.format(outputs['mapped'], outputs['fidelity']))
+    results = {'frames': len(frames), 'repeat': args.repeat, 'throughput': throughput,
+               'metrics': {'mapped': float(outputs['mapped']), 'fidelity': float(outputs['fidelity'])}}
+
+    passed = True
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.golden)), exist_ok=True)
+        sources = ['{}: {}'.format(name, args.source) for name in CHECKS]
+        np.savez_compressed(args.golden, sources=np.array(sources), **outputs)
+        print('Saved golden outputs to {}'.format(args.golden))
+    elif os.path.isfile(args.golden):
+        tolerances = {name: getattr(args, '{}_tolerance'.format(name)) for name in TOLERANCES}
+        with np.load(args.golden) as golden:
+            golden = dict(golden)
+        checks = compare(outputs, golden, tolerances)
+        results['checks'] = checks
+        if 'sources' in golden:
+            print('Golden outputs from')
+            for source in golden['sources']:
+                print('  {}'.format(source))
+        for check in checks:
+            print('{:<19} {:<8} difference {:<12} tolerance {:<8} {}'.format(
+                check['output'], check['measure'],
+                'missing' if check['difference'] is None else '{:.6g}'.format(check['difference']),
+                check['tolerance'], 'ok' if check['passed'] else 'FAILED'))
+        passed = all(check['passed'] for check in checks)
+    else:
+        print('No golden outputs at {}, run with --save first'.format(args.golden))
+        passed = False
+
+    if args.baseline != '':
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['throughput']
+        speed_checks = compare_speed(throughput, baseline, args.max_slowdown)
+        results['speed_checks'] = speed_checks
+        for check in speed_checks:
+            print('{:<21} {:.2f}x baseline time {}'.format(
+                check['function'], check['ratio'], 'ok' if check['passed'] else 'FAILED'))
+        passed = passed and all(check['passed'] for check in speed_checks)
+
+    results['passed'] = passed
+    if args.results != '':
+        with open(args.results, 'w') as results_file:
+            json.dump(results, results_file, indent=2)
+    print('PASSED' if passed else 'FAILED')
+    raise SystemExit(0 if passed else 1)
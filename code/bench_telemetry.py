@@ -0,0 +1,103 @@
+# Compare update_rover with the way telemetry used to be decoded.
+# Messages are built from a recorded run, the same way the simulator sends them.
+# Run it from the code folder: python bench_telemetry.py
+import argparse
+import base64
+import contextlib
+import os
+import time
+from io import BytesIO
+import numpy as np
+from PIL import Image
+
+from supporting_functions import update_rover
+from rover_state import RoverState
+from replay import read_log, telemetry_message
+
+
+# This is how update_rover used to decode telemetry (np.float/np.int were float/int)
+def convert_to_float_legacy(string_to_convert):
+    if ',' in string_to_convert:
+        float_value = float(string_to_convert.replace(',', '.'))
+    else:
+        float_value = float(string_to_convert)
+    return float_value
+
+
+def update_rover_legacy(Rover, data):
+    if Rover.start_time == None:
+        Rover.start_time = time.time()
+        Rover.total_time = 0
+        samples_xpos = np.int_([convert_to_float_legacy(pos.strip()) for pos in data["samples_x"].split(';')])
+        samples_ypos = np.int_([convert_to_float_legacy(pos.strip()) for pos in data["samples_y"].split(';')])
+        Rover.samples_pos = (samples_xpos, samples_ypos)
+        Rover.samples_to_find = int(data["sample_count"])
+    else:
+        tot_time = time.time() - Rover.start_time
+        if np.isfinite(tot_time):
+            Rover.total_time = tot_time
+    print(data.keys())
+    Rover.vel = convert_to_float_legacy(data["speed"])
+    Rover.pos = [convert_to_float_legacy(pos.strip()) for pos in data["position"].split(';')]
+    Rover.yaw = convert_to_float_legacy(data["yaw"])
+    Rover.pitch = convert_to_float_legacy(data["pitch"])
+    Rover.roll = convert_to_float_legacy(data["roll"])
+    Rover.throttle = convert_to_float_legacy(data["throttle"])
+    Rover.steer = convert_to_float_legacy(data["steering_angle"])
+    Rover.near_sample = int(data["near_sample"])
+    Rover.picking_up = int(data["picking_up"])
+    Rover.samples_found = Rover.samples_to_find - int(data["sample_count"])
+    print('speed =', Rover.vel, 'position =', Rover.pos, 'throttle =',
+          Rover.throttle, 'steer_angle =', Rover.steer, 'near_sample:', Rover.near_sample,
+          'picking_up:', data["picking_up"], 'sending pickup:', Rover.send_pickup,
+          'total time:', Rover.total_time, 'samples remaining:', data["sample_count"],
+          'samples found:', Rover.samples_found)
+    imgString = data["image"]
+    image = Image.open(BytesIO(base64.b64decode(imgString)))
+    Rover.img = np.asarray(image)
+    return Rover, image
+
+
+def time_per_message(function, messages, repeat):
+    Rover = RoverState()
+    # The legacy decoder prints every message. Send it nowhere so the terminal is not timed
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for message in messages:
+                function(Rover, message)
+        return (time.perf_counter() - start) / (repeat * len(messages))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Telemetry decoding benchmark')
+    parser.add_argument('log', type=str, nargs='?', default='../test_dataset/robot_log.csv',
+                        help='Path to robot_log.csv. Images are read from the IMG folder next to it.')
+    parser.add_argument('--repeat', type=int, default=5, help='Passes over the whole run.')
+    args = parser.parse_args()
+
+    messages = []
+    for row in read_log(args.log):
+        with open(row['Path'], 'rb') as image_file:
+            messages.append(telemetry_message(row, image_file.read()))
+    print('Built {} telemetry messages'.format(len(messages)))
+
+    # Both decoders must give the same rover state and image
+    mismatches = 0
+    Rover_legacy = RoverState()
+    Rover_fast = RoverState()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for message in messages:
+            update_rover_legacy(Rover_legacy, message)
+            update_rover(Rover_fast, message)
+            same = (np.array_equal(Rover_legacy.img, Rover_fast.img) and Rover_legacy.pos == Rover_fast.pos
+                    and (Rover_legacy.vel, Rover_legacy.yaw, Rover_legacy.pitch, Rover_legacy.roll)
+                    == (Rover_fast.vel, Rover_fast.yaw, Rover_fast.pitch, Rover_fast.roll))
+            mismatches += not same
+    print('Messages decoded differently: {}'.format(mismatches))
+
+    legacy_time = time_per_message(update_rover_legacy, messages, args.repeat)
+    fast_time = time_per_message(update_rover, messages, args.repeat)
+    print('legacy update_rover: {:.3f} ms/message'.format(1000 * legacy_time))
+    print('update_rover:        {:.3f} ms/message'.format(1000 * fast_time))
+    print('speedup: {:.2f}x'.format(legacy_time / fast_time))
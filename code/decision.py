@@ -1,51 +1,17 @@
+import logging
 import numpy as np
 
+from planner import wrap_angle
 
-# This is hacky, I included this here and in perception. Would need rework
-def rotate_pix(xpix, ypix, yaw):
-    # Convert yaw to radians
-    yaw_rad = np.deg2rad(yaw)
+logger = logging.getLogger(__name__)
 
-    # Apply a rotation
-    xpix_rotated = xpix * np.cos(yaw_rad) - ypix * np.sin(yaw_rad)
-    ypix_rotated = xpix * np.sin(yaw_rad) + ypix * np.cos(yaw_rad)
-    # Return the result
-    return xpix_rotated, ypix_rotated
-
-# Define a function to perform a translation
-def translate_pix(xpix_rot, ypix_rot, xpos, ypos, scale):
-    # Apply a scaling and a translation
-    xpix_translated = (xpix_rot / scale) + xpos
-    ypix_translated = (ypix_rot / scale) + ypos
-    # Return the result
-    return xpix_translated, ypix_translated
-
-# Define a function to convert to radial coords in rover space
-def to_polar_coords(x_pixel, y_pixel):
-    # Convert (x_pixel, y_pixel) to (distance, angle)
-    # in polar coordinates in rover space
-    # Calculate distance to each pixel
-    dist = np.sqrt(x_pixel**2 + y_pixel**2)
-    # Calculate angle away from vertical for each pixel
-    angles = np.arctan2(y_pixel, x_pixel)
-    return dist, angles
-
-# Inverse transformation from the one defined in perception
-# It's needed to get information from visited map
-def world_to_pix(x_pix_world, y_pix_world, xpos, ypos, yaw, world_size, scale):
-    # Apply translation
-    xpix_tran, ypix_tran = translate_pix(x_pix_world, y_pix_world, -xpos, -ypos, scale)
-    # Apply rotation
-    xpix_rot, ypix_rot = rotate_pix(xpix_tran, ypix_tran, -yaw)
-    return xpix_rot, ypix_rot
 
 # This is where you can build a decision tree for determining throttle, brake and steer 
 # commands based on the output of the perception_step() function
 def decision_step(Rover):
 
     # Check if we have vision data to make decisions with
-    #print(Rover.speed_check)
-    print(Rover.mode)
+    logger.debug('mode: %s', Rover.mode)
     if Rover.nav_angles is not None:
         # For exploration we do not need to get close to non-navigable terrain
         # with this value we control the amount of navigable terrain that we would accept to move forward
@@ -60,31 +26,64 @@ def decision_step(Rover):
         navigable = Rover.nav_angles[selected_angles]
         trim_angle = 5
         nav_angles = navigable[np.where(np.abs(navigable) < (trim_angle * np.pi / 180))]
+        # Go back home once all samples are collected or the map is covered
+        if not Rover.returning and Rover.home is not None and (
+                0 < Rover.samples_to_find <= Rover.samples_found
+                or Rover.map_stats.perc_mapped() >= Rover.map_goal):
+            logger.info('going back home')
+            Rover.returning = True
+        # Known rock out of view worth going back for
+        known_rock = None
+        if Rover.pick_up_samples and Rover.sample_bearing is None:
+            known_rock = Rover.rocks.nearest(Rover.pos[0], Rover.pos[1], Rover.rock_pursuit_dist)
         if Rover.mode == 'forward':
             # Being stuck takes preference
-            # Rover in forward mode and not moving for 50 frames
-            # This is very dependent on machine frame rate!!!
-            if Rover.speed_check > 50:
+            # Rover in forward mode and not moving for stuck_time seconds
+            if Rover.speed_check > Rover.stuck_time:
                 # Rover stuck. Stop to get out of situation
-                print('I am stuck')
+                logger.info('I am stuck')
                 Rover.mode = 'stop'
                 Rover.brake = Rover.brake_set
                 Rover.throttle = 0
             # Naive greedy implementation for sample. As soon as on is detected go for it unless stuck
             elif (Rover.sample_bearing is not None) and Rover.pick_up_samples:
-                Rover.steer = Rover.sample_bearing * 180 / np.pi
+                # Follow the planned path to the sample, around obstacles, when there is one
+                path_bearing = Rover.paths.bearing(Rover.pos[0], Rover.pos[1], Rover.yaw, *Rover.sample_pos)
+                if path_bearing is None:
+                    path_bearing = Rover.sample_bearing
+                Rover.steer = path_bearing * 180 / np.pi
                 # at a distance reduce speed
                 s_dist = 100
                 if Rover.sample_dist < s_dist:
                     Rover.throttle = 0.02
                 # when close stop
                 if Rover.near_sample:
-                    print('stopping to pickup sample')
+                    logger.debug('stopping to pickup sample')
                     Rover.throttle = 0
                     # Set brake to stored brake value
                     Rover.brake = Rover.brake_set
                     Rover.steer = Rover.sample_bearing * 180 / np.pi
                     Rover.mode = 'stop'
+            # Head for a rock seen before. If we get there and it is not there, forget it
+            elif known_rock is not None:
+                rock_x, rock_y, rock_dist = known_rock
+                if rock_dist < Rover.rock_reach_dist and not Rover.near_sample:
+                    Rover.rocks.collect(rock_x, rock_y, Rover.rock_reach_dist)
+                rock_bearing = Rover.paths.bearing(Rover.pos[0], Rover.pos[1], Rover.yaw, rock_x, rock_y)
+                if rock_bearing is None:
+                    rock_bearing = wrap_angle(np.arctan2(rock_y - Rover.pos[1], rock_x - Rover.pos[0])
+                                              - np.deg2rad(Rover.yaw))
+                Rover.steer = np.clip(rock_bearing * 180 / np.pi, -15, 15)
+                Rover.throttle = Rover.throttle_set if Rover.vel < Rover.max_vel else 0
+                Rover.brake = 0
+            # Back home, job done
+            elif Rover.returning and np.hypot(Rover.pos[0] - Rover.home[0],
+                                              Rover.pos[1] - Rover.home[1]) < Rover.home_dist:
+                logger.debug('back home')
+                Rover.throttle = 0
+                Rover.brake = Rover.brake_set
+                Rover.steer = 0
+                Rover.mode = 'home'
             elif len(Rover.nav_angles) >= Rover.stop_forward:
                 # If mode is forward, navigable terrain looks good 
                 # and velocity is below max, then throttle 
@@ -96,24 +95,28 @@ def decision_step(Rover):
                 Rover.brake = 0
                 # Set steering to average angle clipped to the range +/- 15
                 # We are going to correct the mean navigation angle to help with visiting the whole map
-                x_visited, y_visited = Rover.visited[:, :, 1].nonzero()
-                # Convert world coordinates to local rover coordinates
-                x_pos = Rover.pos[0]
-                y_pos = Rover.pos[1]
-                yaw = Rover.yaw
+                # Only visited cells around the rover (see VisitedMap) are taken into account
                 angles = Rover.nav_angles
-                world_size = Rover.worldmap.shape[0]
                 bottom_offset = 6
-                rover_visited = world_to_pix(y_visited, x_visited, x_pos, y_pos, yaw, world_size, 1)
-                penalty_points_x = rover_visited[0][rover_visited[0] > bottom_offset]
-                penalty_points_y = rover_visited[1][rover_visited[0] > bottom_offset]
-                dist_penalty, angles_penalty = to_polar_coords(penalty_points_x, penalty_points_y)
+                dist_penalty, angles_penalty = Rover.visited.penalty_points(Rover.pos[0], Rover.pos[1],
+                                                                            Rover.yaw, bottom_offset)
                 # check that there are at least one visited point
                 if len(angles_penalty) > 0:
                     # Navigable terrain is considered twice to help with going over the same terrain more than once
                     angles_penalty_mean = angles.mean() - angles_penalty.mean() / 3
                 else:
                     angles_penalty_mean = angles.mean()
+                # Pull towards the path home when returning, otherwise towards the exploration goal
+                # picked by the frontier planner, when it lies in the direction of navigable terrain
+                if Rover.returning:
+                    target_bearing = Rover.paths.bearing(Rover.pos[0], Rover.pos[1], Rover.yaw, *Rover.home)
+                    target_weight = Rover.home_weight
+                else:
+                    target_bearing = Rover.frontier.target_bearing(Rover.pos[0], Rover.pos[1], Rover.yaw)
+                    target_weight = Rover.frontier_weight
+                if target_bearing is not None and angles.min() <= target_bearing <= angles.max():
+                    angles_penalty_mean = ((1 - target_weight) * angles_penalty_mean
+                                           + target_weight * target_bearing)
                 wall_bias = 0.25
                 Rover.steer = np.clip((angles_penalty_mean * 90/np.pi) + wall_bias, -15, 15)
             # If there's a lack of navigable terrain pixels then go to 'stop' mode
@@ -135,15 +138,15 @@ def decision_step(Rover):
             # If we're not moving (vel < 0.2) then do something else
             elif Rover.vel <= 0.2:
                 # Now we're stopped and we have vision data to see if there's a path forward
-                # we take the amount of frames that we have been stopped. We do a maneuver for other 50 frames
-                if Rover.speed_check > 50 and not Rover.near_sample:
+                # we take the time that we have been stopped. We do a maneuver until unstuck_time
+                if Rover.speed_check > Rover.stuck_time and not Rover.near_sample:
                     Rover.throttle = 0
                     # Release the brake to allow turning
                     Rover.brake = 0
                     # Turn range is +/- 15 degrees, when stopped the next line will induce 4-wheel turning
                     # select a side to start turning to. This could be much smarter, for allways same side
                     Rover.steer = 15
-                    if Rover.speed_check > 100:
+                    if Rover.speed_check > Rover.unstuck_time:
                         # try to get out by moving
                         Rover.speed_check = 0
                 # If we're stopped but see sufficient navigable terrain in front then go!
@@ -167,6 +170,8 @@ def decision_step(Rover):
     if Rover.near_sample and Rover.vel == 0 and not Rover.picking_up:
         Rover.send_pickup = True
         Rover.speed_check = 0
+        # This rock is done, do not come back for it
+        Rover.rocks.collect(Rover.pos[0], Rover.pos[1], Rover.rocks.merge_dist)
     
     return Rover
 
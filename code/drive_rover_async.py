@@ -0,0 +1,130 @@
+# Control server on asyncio (python-socketio AsyncServer on aiohttp) instead of eventlet and Flask.
+# It sends the same messages as drive_rover.py and takes the same options. Telemetry is received
+# on the event loop, and the per frame work (decoding, perception, decision) runs in a worker
+# thread, so the loop keeps receiving messages while a frame is processed.
+# Run it from the code folder: python drive_rover_async.py [image_folder] [options]
+import time
+# Time to ready is measured from here
+startup_time = time.perf_counter()
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import socketio
+from aiohttp import web
+
+from pipeline import process_frame, save_frame, control_message, add_arguments, start, stop
+from rover_state import RoverState
+from instrumentation import PipelineStats
+
+sio = socketio.AsyncServer(async_mode='aiohttp')
+app = web.Application()
+sio.attach(app)
+
+# Initialize our rover
+Rover = RoverState()
+# Per stage latency histograms, late and dropped frames
+stats = PipelineStats()
+# The rover state is not thread safe: a single worker thread processes the frames, in order
+executor = ThreadPoolExecutor(max_workers=1)
+# Newest telemetry message not processed yet (only used by the 'latest' scheduler).
+# Created on the event loop when the server starts
+pending_telemetry = None
+
+
+@sio.on('telemetry')
+async def telemetry(sid, data):
+    if data:
+        if args.scheduler == 'latest':
+            # Keep only the newest message. One still waiting for the worker is stale now
+            if pending_telemetry.full():
+                pending_telemetry.get_nowait()
+                stats.record_drop()
+            pending_telemetry.put_nowait(data)
+        else:
+            await handle_telemetry(data)
+    else:
+        await sio.emit('manual', data={}, skip_sid=True)
+
+
+# With the 'latest' scheduler, telemetry is processed here instead of in the handler,
+# so the rover always acts on the most recent image
+async def telemetry_worker():
+    while True:
+        await handle_telemetry(await pending_telemetry.get())
+
+
+async def handle_telemetry(data):
+    with stats.frame():
+        commands, images, pickup = await asyncio.get_running_loop().run_in_executor(executor, run_frame, data)
+        # The action step!  Send commands to the rover!
+        with stats.stage('send_control'):
+            await send_control(commands, *images)
+        # If in a state where want to pickup a rock send pickup command
+        if pickup:
+            await send_pickup()
+    Rover.quality.record(stats.last_frame)
+    stats.maybe_dump(args.stats_file, args.stats_interval)
+
+
+# Runs in the worker thread. The frame is saved here too, before the next frame
+# reuses the camera image buffer
+def run_frame(data):
+    global Rover
+    Rover, commands, images, pickup, image = process_frame(Rover, data, stats, renderer, profiler)
+    save_frame(Rover, image, recorder, args.image_folder)
+    return commands, images, pickup
+
+
+@sio.on('connect')
+async def connect(sid, environ):
+    print("connect ", sid)
+    await send_control((0, 0, 0), '', '')
+    sample_data = {}
+    await sio.emit(
+        "get_samples",
+        sample_data,
+        skip_sid=True)
+
+
+async def send_control(commands, image_string1, image_string2):
+    await sio.emit(
+        "data",
+        control_message(commands, image_string1, image_string2),
+        skip_sid=True)
+
+
+# Define a function to send the "pickup" command
+async def send_pickup():
+    print("Picking up")
+    pickup = {}
+    await sio.emit(
+        "pickup",
+        pickup,
+        skip_sid=True)
+
+
+async def on_startup(app):
+    global pending_telemetry
+    pending_telemetry = asyncio.Queue(maxsize=1)
+    if args.scheduler == 'latest':
+        app['telemetry_worker'] = asyncio.ensure_future(telemetry_worker())
+    print('Ready in {:.2f} s'.format(time.perf_counter() - startup_time))
+
+
+async def on_cleanup(app):
+    if 'telemetry_worker' in app:
+        app['telemetry_worker'].cancel()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Remote Driving (asyncio server)')
+    add_arguments(parser)
+    parser.add_argument('--port', type=int, default=4567, help='Port the simulator connects to.')
+    args = parser.parse_args()
+    renderer, recorder, profiler = start(args, Rover, stats)
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    web.run_app(app, port=args.port)
+    executor.shutdown()
+    stop(args, stats, renderer, recorder, profiler)
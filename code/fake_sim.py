@@ -0,0 +1,103 @@
+# Stand-in for the simulator: replays a recorded run to a control server (drive_rover.py or
+# drive_rover_async.py) at a fixed rate, and measures round trip latency and throughput.
+# Start the server first, then run it from the code folder: python fake_sim.py --rate 25
+import argparse
+import threading
+import time
+import cv2
+import socketio
+
+from replay import load_run, telemetry_message
+from instrumentation import LatencyHistogram
+
+
+# JPEG bytes of every frame: the simulator images as they are for a training log,
+# frames encoded again for a recording
+def jpeg_frames(frames, images):
+    for row, img in zip(frames, images):
+        if 'Path' in row:
+            with open(row['Path'], 'rb') as image_file:
+                yield image_file.read()
+        else:
+            yield cv2.imencode('.jpg', cv2.cvtColor(img, cv2.COLOR_RGB2BGR))[1].tobytes()
+
+
+# Sends telemetry the way the simulator does and counts what comes back.
+# Commands do not say which telemetry message they answer, and servers that drop stale
+# messages answer only some of them, so the latency of a command is measured from the
+# most recent telemetry message sent before it arrived
+class FakeSimulator():
+    def __init__(self, messages):
+        self.messages = messages
+        self.latency = LatencyHistogram()
+        self.sent = 0
+        self.commands = 0
+        self.pickups = 0
+        self.last_sent = None
+        self.lock = threading.Lock()
+        self.sio = socketio.Client()
+        self.sio.on('data', self.on_data)
+        self.sio.on('pickup', self.on_pickup)
+        self.sio.on('manual', self.on_manual)
+        self.sio.on('get_samples', self.on_get_samples)
+
+    def on_data(self, data):
+        with self.lock:
+            # The first command (sent on connect) answers no telemetry
+            if self.last_sent is not None:
+                self.latency.record(time.perf_counter() - self.last_sent)
+                self.commands += 1
+
+    def on_pickup(self, data):
+        self.pickups += 1
+
+    def on_manual(self, data):
+        pass
+
+    def on_get_samples(self, data):
+        pass
+
+    # Send every message rate times per second (as fast as possible if rate is 0), repeat times over
+    def run(self, url, rate, repeat=1, drain=1.0):
+        self.sio.connect(url)
+        interval = 1 / rate if rate > 0 else 0
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for message in self.messages:
+                delay = start + self.sent * interval - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                with self.lock:
+                    self.last_sent = time.perf_counter()
+                self.sio.emit('telemetry', message)
+                self.sent += 1
+        # Give the server time to answer the last messages
+        time.sleep(drain)
+        elapsed = time.perf_counter() - start - drain
+        self.sio.disconnect()
+        return elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fake simulator client')
+    parser.add_argument('log', type=str, nargs='?', default='../test_dataset/robot_log.csv',
+                        help='Path to robot_log.csv or to a recording folder written by '
+                             'drive_rover.py --record_format chunks.')
+    parser.add_argument('--url', type=str, default='http://localhost:4567', help='Control server to connect to.')
+    parser.add_argument('--rate', type=float, default=25, help='Telemetry messages per second (0 for no limit).')
+    parser.add_argument('--repeat', type=int, default=1, help='Passes over the whole run.')
+    args = parser.parse_args()
+
+    frames, images = load_run(args.log)
+    messages = [telemetry_message(row, jpeg) for row, jpeg in zip(frames, jpeg_frames(frames, images))]
+    print('Built {} telemetry messages'.format(len(messages)))
+
+    simulator = FakeSimulator(messages)
+    elapsed = simulator.run(args.url, args.rate, args.repeat)
+    summary = simulator.latency.summary()
+    print('sent {} telemetry messages in {:.1f} s ({:.1f}/s)'.format(
+        simulator.sent, elapsed, simulator.sent / elapsed))
+    print('received {} commands ({:.1f}/s, {} messages unanswered), {} pickups'.format(
+        simulator.commands, simulator.commands / elapsed, simulator.sent - simulator.commands, simulator.pickups))
+    print('round trip: mean {:.2f} ms  p50 {:.2f} ms  p95 {:.2f} ms  p99 {:.2f} ms  max {:.2f} ms'.format(
+        summary['mean_ms'], summary['p50_ms'], summary['p95_ms'], summary['p99_ms'], summary['max_ms']))
@@ -0,0 +1,335 @@
+import bisect
+import cProfile
+import csv
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+# Latency histogram with fixed, geometrically spaced buckets from 10 us to 10 s
+# (each bucket ~12% wider than the previous one). Memory does not grow with the
+# number of samples, and percentiles are read from the bucket edges
+class LatencyHistogram():
+    edges = np.geomspace(1e-5, 10, 121)
+
+    def __init__(self):
+        self.counts = np.zeros(len(self.edges) + 1, np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(self.edges, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    # Upper edge of the bucket holding the q-th percentile (in seconds)
+    def percentile(self, q):
+        if self.count == 0:
+            return 0.0
+        bucket = np.searchsorted(np.cumsum(self.counts), q / 100 * self.count)
+        if bucket >= len(self.edges):
+            return self.max
+        return min(self.edges[bucket], self.max)
+
+    def summary(self):
+        mean = self.total / self.count if self.count else 0.0
+        return {'count': self.count,
+                'mean_ms': 1000 * mean,
+                'p50_ms': 1000 * self.percentile(50),
+                'p95_ms': 1000 * self.percentile(95),
+                'p99_ms': 1000 * self.percentile(99),
+                'max_ms': 1000 * self.max}
+
+
+# Per stage latency histograms for the telemetry pipeline, plus counts of frames,
+# late frames (longer than frame_budget seconds) and dropped frames, and gauges
+# (named values that are set rather than accumulated, like the current quality level).
+# Stages may be timed from other threads (the inset renderer does), so recording is locked
+class PipelineStats():
+    def __init__(self, frame_budget=0.05):
+        self.frame_budget = frame_budget
+        self.stages = {}
+        self.frame_latency = LatencyHistogram()
+        self.frames = 0
+        self.late_frames = 0
+        self.dropped_frames = 0
+        self.last_frame = 0.0  # duration of the most recent frame (seconds)
+        self.gauges = {}
+        self.start_time = time.time()
+        self.last_dump = self.start_time
+        self.lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self.lock:
+            if name not in self.stages:
+                self.stages[name] = LatencyHistogram()
+            self.stages[name].record(seconds)
+
+    # Time the code inside a with block as stage `name`
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    # Time a whole frame, counting it as late if it goes over budget
+    @contextmanager
+    def frame(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self.lock:
+                self.frame_latency.record(seconds)
+                self.last_frame = seconds
+                self.frames += 1
+                if seconds > self.frame_budget:
+                    self.late_frames += 1
+
+    def record_drop(self, count=1):
+        with self.lock:
+            self.dropped_frames += count
+
+    def set_gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def summary(self):
+        with self.lock:
+            return {'uptime_s': time.time() - self.start_time,
+                    'frames': self.frames,
+                    'late_frames': self.late_frames,
+                    'dropped_frames': self.dropped_frames,
+                    'frame_budget_ms': 1000 * self.frame_budget,
+                    'gauges': dict(self.gauges),
+                    'frame': self.frame_latency.summary(),
+                    'stages': {name: hist.summary() for name, hist in self.stages.items()}}
+
+    # Write the summary as JSON, or as CSV if the file name ends in .csv: one row per stage, then
+    # one row per counter (late and dropped frames...) and gauge, with only its value filled in
+    def dump(self, path):
+        summary = self.summary()
+        if path.endswith('.csv'):
+            columns = ['stage', 'count', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms', 'value']
+            with open(path, 'w', newline='') as out_file:
+                writer = csv.DictWriter(out_file, fieldnames=columns)
+                writer.writeheader()
+                writer.writerow(dict(summary['frame'], stage='frame'))
+                for name, stage in summary['stages'].items():
+                    writer.writerow(dict(stage, stage=name))
+                for name in ('frames', 'late_frames', 'dropped_frames', 'frame_budget_ms', 'uptime_s'):
+                    writer.writerow({'stage': name, 'value': summary[name]})
+                for name, value in summary['gauges'].items():
+                    writer.writerow({'stage': name, 'value': value})
+        else:
+            with open(path, 'w') as out_file:
+                json.dump(summary, out_file, indent=2)
+        self.last_dump = time.time()
+
+    # Dump if more than interval seconds went by since the last time
+    def maybe_dump(self, path, interval):
+        if path and time.time() - self.last_dump > interval:
+            self.dump(path)
+
+    # Short human readable report
+    def report(self):
+        summary = self.summary()
+        lines = ['{} frames, {} late (> {:.0f} ms), {} dropped'.format(
+            summary['frames'], summary['late_frames'], summary['frame_budget_ms'], summary['dropped_frames'])]
+        if summary['gauges']:
+            lines.append('  ' + '  '.join('{}: {}'.format(name, value) for name, value in summary['gauges'].items()))
+        for name, stage in [('frame', summary['frame'])] + list(summary['stages'].items()):
+            lines.append('  {:<12} mean {:7.2f} ms  p50 {:7.2f}  p95 {:7.2f}  p99 {:7.2f}  max {:7.2f}'.format(
+                name, stage['mean_ms'], stage['p50_ms'], stage['p95_ms'], stage['p99_ms'], stage['max_ms']))
+        return '\n'.join(lines)
+
+
+# Perception quality levels traded for speed when frames go over budget.
+# Each level is (map_every, pixel_stride): the worldmap is updated on one frame out of
+# map_every, from one pixel in view out of pixel_stride.
+# Navigable terrain angles and distances, which steering needs, are computed on every frame
+QUALITY_LEVELS = ((1, 1), (2, 1), (4, 2))
+
+
+# Pick the quality level from the frame durations, with hysteresis: drop one level after
+# down_after frames in a row averaging over budget, and go back up one level after up_after
+# frames in a row averaging under headroom * budget. Durations are smoothed (exponential
+# average with weight smoothing) so a single slow frame does not change the level
+class AdaptiveQuality():
+    def __init__(self, budget=0.05, enabled=False, headroom=0.6, down_after=5, up_after=30,
+                 smoothing=0.2, stats=None):
+        self.budget = budget
+        self.enabled = enabled
+        self.headroom = headroom
+        self.down_after = down_after
+        self.up_after = up_after
+        self.smoothing = smoothing
+        self.stats = stats  # optional PipelineStats to publish the level as a gauge
+        self.level = 0
+        self.changes = 0
+        self.average = None
+        self.over = 0
+        self.under = 0
+        self.frames = 0
+        if stats is not None:
+            stats.set_gauge('quality_level', self.level)
+
+    # Account for the duration (seconds) of the last frame
+    def record(self, seconds):
+        if not self.enabled:
+            return
+        if self.average is None:
+            self.average = seconds
+        else:
+            self.average += self.smoothing * (seconds - self.average)
+        self.over = self.over + 1 if self.average > self.budget else 0
+        self.under = self.under + 1 if self.average < self.headroom * self.budget else 0
+        if self.over >= self.down_after and self.level < len(QUALITY_LEVELS) - 1:
+            self.set_level(self.level + 1)
+        elif self.under >= self.up_after and self.level > 0:
+            self.set_level(self.level - 1)
+
+    def set_level(self, level):
+        self.level = level
+        self.changes += 1
+        self.over = 0
+        self.under = 0
+        if self.stats is not None:
+            self.stats.set_gauge('quality_level', level)
+            self.stats.set_gauge('quality_changes', self.changes)
+
+    # Whether the worldmap is updated on this frame. Call once per frame
+    def mapping_frame(self):
+        self.frames += 1
+        return self.frames % QUALITY_LEVELS[self.level][0] == 0
+
+    def pixel_stride(self):
+        return QUALITY_LEVELS[self.level][1]
+
+
+# Profile a bounded window of frames, then switch off again. Modes:
+#   'cprofile'     deterministic profile of the code run in scope() blocks, written as one .prof file
+#                  per scope (for pstats or snakeviz) plus a text report of all of them
+#   'tracemalloc'  memory allocated during the window by the code of this folder, by source line,
+#                  and the peak of traced memory, as a text report. tracemalloc traces the whole
+#                  process (stopping it drops the traces), so this covers every thread and not
+#                  only scope() blocks, and the report says so
+# Call frame() around the per frame work and scope(name) around the parts to profile. Scopes may
+# run in other threads (the inset renderer does): cProfile profiles one thread at a time, so each
+# scope has its own profile, and a scope that cannot be profiled while another one is is skipped.
+# The first window starts at frame start (None to wait for request()), and request() starts another one
+class FrameProfiler():
+    def __init__(self, mode=None, frames=200, output='profile', start=0):
+        self.mode = mode
+        self.frames = frames
+        self.output = output  # reports are written to output_<window>...
+        self.start_at = start if mode is not None else None
+        self.frame_count = 0
+        self.remaining = 0  # frames left in the current window
+        self.windows = 0
+        self.profiles = {}
+        self.skipped = 0
+        self.snapshot = None
+        self.lock = threading.Lock()
+
+    # Start a window on the next frame
+    def request(self):
+        if self.mode is not None and self.remaining == 0:
+            self.start_at = self.frame_count
+
+    @contextmanager
+    def frame(self):
+        if self.remaining == 0 and self.start_at is not None and self.frame_count >= self.start_at:
+            self.start_window()
+        self.frame_count += 1
+        try:
+            yield
+        finally:
+            if self.remaining > 0:
+                self.remaining -= 1
+                if self.remaining == 0:
+                    self.finish_window()
+
+    @contextmanager
+    def scope(self, name):
+        profile = None
+        if self.remaining > 0 and self.mode == 'cprofile':
+            with self.lock:
+                profile = self.profiles.setdefault(name, cProfile.Profile())
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler is active (on Python 3.12+ only one can be at a time)
+                self.skipped += 1
+                profile = None
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+
+    def start_window(self):
+        self.start_at = None
+        self.remaining = self.frames
+        self.windows += 1
+        self.profiles = {}
+        self.skipped = 0
+        if self.mode == 'tracemalloc':
+            tracemalloc.start()
+            self.snapshot = tracemalloc.take_snapshot()
+            tracemalloc.reset_peak()
+        logger.info('Profiling %d frames (%s)', self.frames, self.mode)
+
+    def finish_window(self):
+        self.remaining = 0
+        prefix = '{}_{}'.format(self.output, self.windows)
+        report = io.StringIO()
+        if self.mode == 'cprofile':
+            with self.lock:
+                profiles = dict(self.profiles)
+            combined = None
+            for name, profile in profiles.items():
+                profile.dump_stats('{}_{}.prof'.format(prefix, name))
+                if combined is None:
+                    combined = pstats.Stats(profile, stream=report)
+                else:
+                    combined.add(profile)
+            report.write('{} frames, scopes: {}, {} scope calls skipped\n'.format(
+                self.frames, ', '.join(profiles), self.skipped))
+            if combined is not None:
+                combined.sort_stats('cumulative').print_stats(40)
+        else:
+            # Only allocations made by the code of this folder
+            code_filter = [tracemalloc.Filter(True, os.path.join(os.path.dirname(os.path.abspath(__file__)), '*'))]
+            snapshot = tracemalloc.take_snapshot().filter_traces(code_filter)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            report.write('{} frames, peak traced memory {:.1f} MB\n'.format(self.frames, peak / 1e6))
+            report.write('Whole process snapshot: allocations of every thread during the window, not only in '
+                         'the profiled scopes, filtered to the files of {}\n'.format(code_filter[0].filename_pattern))
+            report.write('Memory allocated during the window and still held at its end, by line:\n')
+            for difference in snapshot.compare_to(self.snapshot.filter_traces(code_filter), 'lineno')[:40]:
+                report.write('{}\n'.format(difference))
+            self.snapshot = None
+        with open(prefix + '.txt', 'w') as report_file:
+            report_file.write(report.getvalue())
+        logger.info('Profile written to %s.txt', prefix)
+
+    # Write out the window in progress, if any
+    def close(self):
+        if self.remaining > 0:
+            self.finish_window()
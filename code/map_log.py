@@ -0,0 +1,168 @@
+# Build the worldmap of a recorded run offline, all frames at once, with PerceptionContext.map_frames.
+# Useful to try perception thresholds on long recordings without replaying them frame by frame.
+# Run it from the code folder: python map_log.py ../test_dataset/robot_log.csv --check
+import argparse
+import time
+from multiprocessing import Pool, shared_memory
+import numpy as np
+
+from perception import perception_step, PerceptionContext
+from mapping import OccupancyGrid, add_observations
+from rover_state import RoverState
+from replay import load_run, update_rover_from_log
+from recording import Recording
+
+
+# Pose arrays (x, y, yaw, pitch, roll) of every frame of a log
+def log_poses(frames):
+    return tuple(np.array([float(row[key]) for row in frames])
+                 for key in ('X_Position', 'Y_Position', 'Yaw', 'Pitch', 'Roll'))
+
+
+# Add the run to the worldmap and map statistics of Rover, mapping all frames at once
+def map_log(Rover, frames, images, chunk_size=8):
+    xpos, ypos, yaw, pitch, roll = log_poses(frames)
+    Rover.perception_context.map_frames(images, xpos, ypos, yaw, pitch, roll, Rover.worldmap,
+                                        Rover.occupancy, Rover.map_stats, chunk_size=chunk_size)
+    return Rover
+
+
+# Frames of a run copied into shared memory, so worker processes read them without pickling.
+# Call close() when done with it
+class SharedFrames():
+    def __init__(self, images):
+        self.memory = shared_memory.SharedMemory(create=True, size=images.nbytes)
+        self.shape = images.shape
+        self.images = np.ndarray(images.shape, np.uint8, buffer=self.memory.buf)
+        self.images[:] = images
+
+    def close(self):
+        del self.images
+        self.memory.close()
+        self.memory.unlink()
+
+
+# State of each worker process: its perception context and its view of the frames
+worker = {}
+
+
+# Worker reading the frames from shared memory
+def init_worker(memory_name, shape):
+    worker['memory'] = shared_memory.SharedMemory(name=memory_name)
+    worker['images'] = np.ndarray(shape, np.uint8, buffer=worker['memory'].buf)
+    worker['context'] = PerceptionContext(shape[1:])
+    worker['occupancy'] = OccupancyGrid(worker['context'].world_size)
+
+
+# Worker reading the frames straight from a recording, memory mapped
+def init_recording_worker(path):
+    worker['images'] = Recording(path)
+    worker['context'] = PerceptionContext(worker['images'].frame_shape)
+    worker['occupancy'] = OccupancyGrid(worker['context'].world_size)
+
+
+# Observations of frames first to last: sample hit counts and log-odds changes of every chunk
+def observe_shard(shard):
+    first, last, xpos, ypos, yaw, pitch, roll = shard
+    return worker['context'].observe_frames(worker['images'], xpos, ypos, yaw, pitch, roll,
+                                            worker['occupancy'], first=first)
+
+
+# Add the run to the worldmap and map statistics of Rover, sharding the frames across a pool
+# of worker processes (started with init_worker on shared frames). Each worker observes its
+# frames independently. Sample hit counts are summed, and the log-odds changes are added
+# shard after shard in frame order, so the result is the same as mapping the frames in sequence
+def map_log_parallel(Rover, frames, pool, processes, shards_per_process=2):
+    poses = log_poses(frames)
+    bounds = np.linspace(0, len(frames), processes * shards_per_process + 1).astype(int)
+    shards = [(first, last) + tuple(values[first:last] for values in poses)
+              for first, last in zip(bounds[:-1], bounds[1:]) if last > first]
+    sample_counts = 0
+    updates = []
+    for shard_counts, shard_updates in pool.imap(observe_shard, shards):
+        sample_counts = sample_counts + shard_counts
+        updates.extend(shard_updates)
+    add_observations(Rover.worldmap, Rover.occupancy, sample_counts, updates, Rover.map_stats)
+    return Rover
+
+
+# Add the run to the worldmap and map statistics of Rover, running perception_step on every frame
+def map_log_sequential(Rover, frames, images):
+    Rover.samples_pos = (np.int_([]), np.int_([]))
+    start_time = float(frames[0]['Time'])
+    for row, img in zip(frames, images):
+        Rover = perception_step(update_rover_from_log(Rover, row, img, start_time))
+    return Rover
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Map a recorded run offline')
+    parser.add_argument('log', type=str, nargs='?', default='../test_dataset/robot_log.csv',
+                        help='Path to robot_log.csv (images are read from the IMG folder next to it) '
+                             'or to a recording folder written by drive_rover.py --record_format chunks.')
+    parser.add_argument('--chunk_size', type=int, default=8, help='Frames processed together.')
+    parser.add_argument('--check', action='store_true',
+                        help='Also map the run frame by frame with perception_step and compare.')
+    parser.add_argument('--processes', type=int, default=0,
+                        help='Also map the run with pools of 1 to this many processes and report the speedup.')
+    parser.add_argument('--output', type=str, default='', help='Save the worldmap to this .npy file.')
+    args = parser.parse_args()
+
+    load_start = time.perf_counter()
+    frames, images = load_run(args.log)
+    # Recordings are read in place, decoded log images are stacked into one array
+    if not isinstance(images, Recording):
+        images = np.stack(images)
+    print('Loaded {} frames in {:.2f} s'.format(len(frames), time.perf_counter() - load_start))
+
+    # Rover states are created before timing, building the perception context takes a while
+    Rover = RoverState()
+    start = time.perf_counter()
+    Rover = map_log(Rover, frames, images, args.chunk_size)
+    total = time.perf_counter() - start
+    print('Batch:      {:.1f} frames/s ({:.2f} ms/frame)'.format(len(frames) / total, 1000 * total / len(frames)))
+    print('  Mapped: {}%  Fidelity: {}%'.format(Rover.map_stats.perc_mapped(), Rover.map_stats.fidelity()))
+    if args.output != '':
+        np.save(args.output, Rover.worldmap)
+
+    if args.check:
+        Rover_sequential = RoverState()
+        start = time.perf_counter()
+        Rover_sequential = map_log_sequential(Rover_sequential, frames, images)
+        total_sequential = time.perf_counter() - start
+        print('Sequential: {:.1f} frames/s ({:.2f} ms/frame)'.format(
+            len(frames) / total_sequential, 1000 * total_sequential / len(frames)))
+        print('  Mapped: {}%  Fidelity: {}%'.format(Rover_sequential.map_stats.perc_mapped(),
+                                                   Rover_sequential.map_stats.fidelity()))
+        print('Worldmap cells that differ: {}'.format(
+            np.count_nonzero(Rover.worldmap != Rover_sequential.worldmap)))
+
+    if args.processes > 0:
+        # Workers read the frames of a recording from its files, and the frames of a log from shared memory
+        if isinstance(images, Recording):
+            frames_shared = None
+            initializer, initargs = init_recording_worker, (args.log,)
+        else:
+            frames_shared = SharedFrames(images)
+            initializer, initargs = init_worker, (frames_shared.memory.name, frames_shared.shape)
+        try:
+            base_time = None
+            for processes in range(1, args.processes + 1):
+                start = time.perf_counter()
+                with Pool(processes, initializer, initargs) as pool:
+                    # Make sure every worker is up (built its perception context) before timing
+                    pool.map(time.sleep, [0.05] * processes, chunksize=1)
+                    startup = time.perf_counter() - start
+                    Rover_parallel = RoverState()
+                    start = time.perf_counter()
+                    Rover_parallel = map_log_parallel(Rover_parallel, frames, pool, processes)
+                    total_parallel = time.perf_counter() - start
+                base_time = base_time or total_parallel
+                print('{} processes: {:.1f} frames/s ({:.2f} ms/frame), speedup {:.2f}x, '
+                      'pool startup {:.2f} s, cells that differ: {}'.format(
+                          processes, len(frames) / total_parallel, 1000 * total_parallel / len(frames),
+                          base_time / total_parallel, startup,
+                          np.count_nonzero(Rover_parallel.worldmap != Rover.worldmap)))
+        finally:
+            if frames_shared is not None:
+                frames_shared.close()
@@ -0,0 +1,219 @@
+import copy
+import numpy as np
+import cv2
+
+
+# Flat (one entry per cell) view of one channel of the worldmap. No data is copied,
+# so writing into it updates the worldmap
+def map_channel(worldmap, channel):
+    return worldmap.reshape(-1, worldmap.shape[2])[:, channel]
+
+
+# Add increment to the map cells in hits (flat cell indices), saturating at limit.
+# A cell hit n times in the same call gets n increments.
+# Only the touched cells are read and written. Returns their indices and previous values
+def add_hits(map_cells, hits, increment=20, limit=255):
+    if len(hits) == 0:
+        return hits, map_cells[hits]
+    # Count hits per cell. Offsetting by the lowest cell keeps the counts array
+    # as small as the area in view instead of the whole map
+    first = hits.min()
+    counts = np.bincount(hits - first)
+    touched = np.flatnonzero(counts)
+    cells = touched + first
+    old_values = map_cells[cells]
+    map_cells[cells] = np.minimum(old_values + increment * counts[touched], limit)
+    return cells, old_values
+
+
+# Add increment times counts (one count per map cell) to the map, saturating at limit.
+# Same result as calling add_hits with every hit that was counted.
+# Returns the indices and previous values of the cells that changed
+def add_counts(map_cells, counts, increment=20, limit=255):
+    cells = np.flatnonzero(counts)
+    old_values = map_cells[cells]
+    map_cells[cells] = np.minimum(old_values + increment * counts[cells], limit)
+    return cells, old_values
+
+
+# Log-odds occupancy grid: for every map cell, the log-odds of it being an obstacle, stored
+# as int8 (log-odds times 16, clamped to +-limit). A frame is one observation of each cell it
+# sees: every pixel votes obstacle_vote or navigable_vote, weighted by how reliable it is, and
+# the cell gets the mean vote of its pixels. Cells are navigable once their log-odds reach
+# -threshold and obstacles once they reach threshold, so a class is a single comparison.
+# The worldmap obstacle (0) and navigable (2) channels show the classified cells, brighter as
+# they get more certain, so they can be displayed and planned on as they are
+class OccupancyGrid():
+    def __init__(self, world_size=200, obstacle_vote=4, navigable_vote=-16, threshold=6, limit=64,
+                 pitch_limit=5, roll_limit=5):
+        self.log_odds = np.zeros(world_size * world_size, np.int8)
+        self.limit = limit
+        self.pitch_limit = pitch_limit  # frames pitching or rolling this much (degrees) are not mapped
+        self.roll_limit = roll_limit
+        # Vote of each pixel class (see perception.OBSTACLE, SAMPLE and NAVIGABLE): samples do not vote
+        self.class_votes = np.zeros(256)
+        self.class_votes[0] = obstacle_vote
+        self.class_votes[[2, 3]] = navigable_vote
+        # Worldmap values of every log-odds, indexed by the int8 log-odds read as uint8
+        log_odds = np.arange(256).astype(np.uint8).view(np.int8).astype(np.float64)
+        certainty = np.clip((np.abs(log_odds) - threshold) / max(limit - threshold, 1), 0, 1)
+        shade = np.round(128 + 127 * certainty).astype(np.uint8)
+        self.obstacle_lut = np.where(log_odds >= threshold, shade, 0).astype(np.uint8)
+        self.navigable_lut = np.where(log_odds <= -threshold, shade, 0).astype(np.uint8)
+
+    # Weight (0 to 1) of the frames taken with the rover tilted (degrees, arrays or numbers):
+    # 1 when level, going down to 0 at pitch_limit or roll_limit, as the warp gets less accurate
+    def tilt_weight(self, pitch, roll):
+        pitch = np.minimum(pitch % 360, 360 - pitch % 360)
+        roll = np.minimum(roll % 360, 360 - roll % 360)
+        return np.clip(1 - np.maximum(pitch / self.pitch_limit, roll / self.roll_limit), 0, 1)
+
+    # Log-odds changes from one frame: cells are the map cells (flat indices) hit by the pixels,
+    # classes their classes and weights their reliability. Returns the cells that change and by how much
+    def frame_deltas(self, cells, classes, weights):
+        _, cells, deltas = self.chunk_deltas(cells[None], classes[None], weights[None])
+        return cells, deltas
+
+    # Log-odds changes from a chunk of frames at once: cells, classes and weights are as in frame_deltas,
+    # with one row per frame. Votes are averaged per frame and cell with a single bincount over
+    # frame * span + cell keys. Returns the frame (row), cell and change of every change, in frame order
+    def chunk_deltas(self, cells, classes, weights):
+        if cells.size == 0:
+            return np.zeros((3, 0), np.int64)
+        votes = np.take(self.class_votes, classes)
+        votes *= weights
+        # Cells offset by the lowest cell, as in add_hits, so the keys only span the cells in view.
+        # Pixels that do not vote go to one more key after them, which is left out
+        first = cells.min()
+        span = cells.max() - first + 1
+        keys = cells - first
+        keys += np.arange(0, len(keys) * span, span)[:, None]
+        not_voting = votes == 0
+        if not_voting.any():
+            keys[not_voting] = len(keys) * span
+        counts = np.bincount(keys.ravel(), minlength=len(keys) * span + 1)[:-1]
+        sums = np.bincount(keys.ravel(), weights=votes.ravel(), minlength=len(keys) * span + 1)[:-1]
+        touched = np.flatnonzero(counts)
+        deltas = np.rint(sums[touched] / counts[touched]).astype(np.int64)
+        changed = deltas != 0
+        frames, cells = np.divmod(touched[changed], span)
+        return frames, cells + first, deltas[changed]
+
+    # Add log-odds changes (from frame_deltas), clamped to +-limit
+    def add(self, cells, deltas):
+        self.log_odds[cells] = np.clip(self.log_odds[cells] + deltas, -self.limit, self.limit)
+
+    # Add the log-odds changes of a chunk (from chunk_deltas). They are clamped, so frame after frame
+    def add_chunk(self, frames, cells, deltas):
+        bounds = np.flatnonzero(np.diff(frames)) + 1
+        for frame_cells, frame_deltas in zip(np.split(cells, bounds), np.split(deltas, bounds)):
+            self.add(frame_cells, frame_deltas)
+
+    # Show the class of cells (flat indices) in the worldmap, and account for the changes in map_stats if given
+    def show(self, worldmap, cells, map_stats=None):
+        index = self.log_odds[cells].view(np.uint8)
+        for channel, lut in ((0, self.obstacle_lut), (2, self.navigable_lut)):
+            map_cells = map_channel(worldmap, channel)
+            old_values = map_cells[cells]
+            new_values = lut[index]
+            map_cells[cells] = new_values
+            if map_stats is not None:
+                map_stats.update(channel, cells, old_values, new_values)
+
+    # Add the changes of one frame and show them in the worldmap
+    def fuse(self, cells, deltas, worldmap, map_stats=None):
+        self.add(cells, deltas)
+        self.show(worldmap, cells, map_stats)
+
+
+# Add the observations of a batch of frames to the worldmap: the rock sample hit counts
+# (one per cell) and the log-odds changes of every chunk of frames (a list of (frames, cells, deltas)
+# from chunk_deltas), and account for them in map_stats if given. Returns the worldmap
+def add_observations(worldmap, occupancy, sample_counts, updates, map_stats=None):
+    map_cells = map_channel(worldmap, 1)
+    cells, old_values = add_counts(map_cells, sample_counts)
+    if map_stats is not None:
+        map_stats.update(1, cells, old_values, map_cells[cells])
+    # Log-odds are clamped, so changes must be added chunk by chunk, in order.
+    # The worldmap only needs the final values
+    for frames, cells, deltas in updates:
+        occupancy.add_chunk(frames, cells, deltas)
+    if updates:
+        occupancy.show(worldmap, np.unique(np.concatenate([cells for _, cells, _ in updates])), map_stats)
+    return worldmap
+
+
+# Map statistics updated from the cells that change on each frame, instead of
+# rescanning the whole map when the output images are created
+class MapStats():
+    def __init__(self, ground_truth, channels=3):
+        # Everything derived from the (static) ground truth map is computed only once
+        self.ground_truth_cells = ground_truth[:, :, 1].reshape(-1) > 0
+        self.tot_map_pix = np.count_nonzero(self.ground_truth_cells)
+        self.ground_truth_overlay = ground_truth * 0.5
+        # Per channel: number of nonzero cells
+        self.mapped_cells = np.zeros(channels, np.int64)
+        # Navigable cells that are (good) or are not (bad) on the ground truth map
+        self.good_nav_pix = 0
+        self.bad_nav_pix = 0
+
+    # Account for map cells of a channel going from old_values to new_values.
+    # Cells may go back to zero, as occupancy grid cells do when their class changes
+    def update(self, channel, cells, old_values, new_values):
+        # +1 for cells that become nonzero, -1 for cells that go back to zero
+        change = (new_values > 0).astype(np.int64) - (old_values > 0)
+        self.mapped_cells[channel] += np.sum(change)
+        if channel == 2:
+            good = np.sum(change[self.ground_truth_cells[cells]])
+            self.good_nav_pix += good
+            self.bad_nav_pix += np.sum(change) - good
+
+    # Independent copy of the current statistics (the ground truth data is shared)
+    def snapshot(self):
+        stats = copy.copy(self)
+        stats.mapped_cells = self.mapped_cells.copy()
+        return stats
+
+    # Percentage of ground truth map that has been successfully found
+    def perc_mapped(self):
+        return round(100 * self.good_nav_pix / self.tot_map_pix, 1)
+
+    # Percentage of good map pixel detections over total pixels found to be navigable terrain
+    def fidelity(self):
+        tot_nav_pix = self.mapped_cells[2]
+        if tot_nav_pix > 0:
+            return round(100 * self.good_nav_pix / tot_nav_pix, 1)
+        return 0
+
+
+# Places visited by the rover, marked as it drives. Steering looks up the visited cells
+# in a fixed size window around the rover, so the cost of a query does not grow
+# with the distance driven
+class VisitedMap():
+    def __init__(self, world_size=200, mark_size=4, window=50):
+        self.grid = np.zeros((world_size, world_size), np.uint8)
+        self.mark_size = mark_size  # size in pixels in the world map assumed as visited
+        self.window = window  # cells around the rover considered when steering
+
+    def mark(self, x_pos, y_pos):
+        cv2.circle(self.grid, (int(np.round(x_pos)), int(np.round(y_pos))), self.mark_size, 1, 1)
+
+    # Polar coordinates (rover frame, 1 cell per unit) of visited cells near the rover
+    # that are more than min_dist in front of it
+    def penalty_points(self, x_pos, y_pos, yaw, min_dist):
+        size = self.grid.shape[0]
+        x_min = max(int(x_pos) - self.window, 0)
+        y_min = max(int(y_pos) - self.window, 0)
+        x_max = min(int(x_pos) + self.window + 1, size)
+        y_max = min(int(y_pos) + self.window + 1, size)
+        y_visited, x_visited = self.grid[y_min:y_max, x_min:x_max].nonzero()
+        # Convert world coordinates to local rover coordinates
+        x_world = x_visited + (x_min - x_pos)
+        y_world = y_visited + (y_min - y_pos)
+        yaw_rad = np.deg2rad(yaw)
+        x_rover = x_world * np.cos(yaw_rad) + y_world * np.sin(yaw_rad)
+        y_rover = y_world * np.cos(yaw_rad) - x_world * np.sin(yaw_rad)
+        ahead = x_rover > min_dist
+        x_rover = x_rover[ahead]
+        y_rover = y_rover[ahead]
+        return np.sqrt(x_rover**2 + y_rover**2), np.arctan2(y_rover, x_rover)
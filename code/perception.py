@@ -1,6 +1,12 @@
+import logging
 import numpy as np
 import cv2
 
+from mapping import map_channel, add_hits, add_observations
+from rocks import find_rocks
+
+logger = logging.getLogger(__name__)
+
 
 # Identify pixels above the threshold
 # Threshold of RGB > 160 does a nice job of identifying ground pixels only
@@ -24,8 +30,8 @@ def rover_coords(binary_img):
     ypos, xpos = binary_img.nonzero()
     # Calculate pixel positions with reference to the rover position being at the 
     # center bottom of the image.  
-    x_pixel = np.absolute(ypos - binary_img.shape[0]).astype(np.float)
-    y_pixel = -(xpos - binary_img.shape[0]).astype(np.float)
+    x_pixel = np.absolute(ypos - binary_img.shape[0]).astype(np.float64)
+    y_pixel = -(xpos - binary_img.shape[0]).astype(np.float64)
     return x_pixel, y_pixel
 
 
@@ -84,105 +90,310 @@ def perspect_transform(img, src, dst):
     return warped
 
 
+# Pixel classes produced by the classifier. A pixel that is both navigable and sample
+# (it never happens with the default thresholds) gets both bits
+OBSTACLE = 0
+SAMPLE = 1
+NAVIGABLE = 2
+
+
+# Build a lookup table with the class of every possible color (2**24 entries).
+# The table is indexed with red | green << 8 | blue << 16, which is how an RGBA pixel reads
+# as a little endian 32 bit integer once alpha is dropped.
+# Entries are built with the same cv2 calls used before, so the result is identical to them
+def build_class_lut(rgb_thresh=(160, 160, 160), hsv_low_thresh=(20, 100, 100), hsv_high_thresh=(30, 255, 255)):
+    lut = np.zeros((256, 256 * 256), np.uint8)
+    # one 256x256 image with every red/green combination, blue is filled in for each row of the table
+    green, red = np.indices((256, 256), dtype=np.uint8)
+    colors = np.dstack((red, green, np.zeros_like(red)))
+    hsv_img = np.zeros_like(colors)
+    for blue in range(256):
+        colors[:, :, 2] = blue
+        nav_select = cv2.inRange(colors, rgb_thresh, (255, 255, 255))
+        cv2.cvtColor(colors, cv2.COLOR_RGB2HSV, dst=hsv_img)
+        sample_select = cv2.inRange(hsv_img, hsv_low_thresh, hsv_high_thresh)
+        lut[blue] = ((nav_select.ravel() & NAVIGABLE) | (sample_select.ravel() & SAMPLE))
+    return lut.ravel()
+
+
+# Everything in the perception pipeline that does not depend on the camera image.
+# Build it once at startup and let perception_step read from it on every frame
+class PerceptionContext():
+    def __init__(self, img_shape=(160, 320, 3), dst_size=5, bottom_offset=6, distance=120,
+                 rgb_thresh=(160, 160, 160), hsv_low_thresh=(20, 100, 100), hsv_high_thresh=(30, 255, 255),
+                 world_size=200, scale=10, far_weight=0.5, crop=True):
+        height, width = img_shape[0], img_shape[1]
+        self.img_shape = img_shape
+        # Source and destination points for perspective transform
+        self.source = np.float32([[14, 140], [301, 140], [200, 96], [118, 96]])
+        self.destination = np.float32([[width/2 - dst_size, height - bottom_offset],
+                                       [width/2 + dst_size, height - bottom_offset],
+                                       [width/2 + dst_size, height - 2*dst_size - bottom_offset],
+                                       [width/2 - dst_size, height - 2*dst_size - bottom_offset],
+                                       ])
+        self.M = cv2.getPerspectiveTransform(self.source, self.destination)
+        # mask far away pixels as they are more distorted
+        self.mask = np.zeros((height, width), np.uint8)
+        cv2.circle(self.mask, (width // 2, height), distance, 1, thickness=-1)
+        # Remap table: for every destination pixel, where it comes from in the camera image.
+        # This is what warpPerspective computes internally on every call
+        _, M_inv = cv2.invert(self.M)
+        ypos, xpos = np.indices((height, width), dtype=np.float64)
+        w = M_inv[2, 0] * xpos + M_inv[2, 1] * ypos + M_inv[2, 2]
+        w[w == 0] = np.finfo(np.float64).eps
+        map_x = ((M_inv[0, 0] * xpos + M_inv[0, 1] * ypos + M_inv[0, 2]) / w).astype(np.float32)
+        map_y = ((M_inv[1, 0] * xpos + M_inv[1, 1] * ypos + M_inv[1, 2]) / w).astype(np.float32)
+        # Pixels outside the mask read from outside the camera image, so they come out black.
+        # That way the warp and the mask are applied in a single call
+        map_x[self.mask == 0] = -10
+        map_y[self.mask == 0] = -10
+        # Only part of the warped image gets camera data: the camera view clipped by the distance mask.
+        # If crop, only the bounding box of that part is warped (the region of interest, roi), from
+        # the smallest part of the camera image it reads from (source_roi). Both are (row slice, column slice).
+        # Everything outside the box stays black, so the result is the same as warping the whole image
+        in_view = cv2.remap(np.full((height, width), 255, np.uint8), map_x, map_y, cv2.INTER_LINEAR,
+                            borderMode=cv2.BORDER_CONSTANT, borderValue=0) > 0
+        if crop:
+            rows, columns = np.nonzero(in_view)
+            self.roi = (slice(int(rows.min()), int(rows.max()) + 1), slice(int(columns.min()), int(columns.max()) + 1))
+            # Bilinear interpolation reads the source pixel at the floor of the coordinates and the next one
+            source_x = np.floor(map_x[in_view])
+            source_y = np.floor(map_y[in_view])
+            self.source_roi = (slice(max(int(source_y.min()), 0), min(int(source_y.max()) + 2, height)),
+                               slice(max(int(source_x.min()), 0), min(int(source_x.max()) + 2, width)))
+        else:
+            self.roi = (slice(0, height), slice(0, width))
+            self.source_roi = self.roi
+        self.map_x = np.ascontiguousarray(map_x[self.roi] - self.source_roi[1].start)
+        self.map_y = np.ascontiguousarray(map_y[self.roi] - self.source_roi[0].start)
+        roi_height, roi_width = self.map_x.shape
+        source_height = self.source_roi[0].stop - self.source_roi[0].start
+        source_width = self.source_roi[1].stop - self.source_roi[1].start
+        # Color to class lookup table, and class to 0/255 mask tables for each class
+        self.class_lut = build_class_lut(rgb_thresh, hsv_low_thresh, hsv_high_thresh)
+        self.mask_luts = [np.zeros(256, np.uint8) for _ in range(3)]
+        self.mask_luts[0][OBSTACLE] = 255
+        self.mask_luts[1][[SAMPLE, SAMPLE | NAVIGABLE]] = 255
+        self.mask_luts[2][[NAVIGABLE, SAMPLE | NAVIGABLE]] = 255
+        # Rover-centric coordinates of every pixel of the warped region (flattened), exactly what
+        # rover_coords would return for it in the whole image, and their polar coordinates
+        self.world_size = world_size
+        self.scale = scale
+        rover_x, rover_y = rover_coords(np.ones((height, width), np.uint8))
+        self.rover_x = rover_x.reshape(height, width)[self.roi].ravel()
+        self.rover_y = rover_y.reshape(height, width)[self.roi].ravel()
+        self.dists, self.angles = to_polar_coords(self.rover_x, self.rover_y)
+        # Output buffers reused across frames
+        self.world_x = np.zeros(roi_height * roi_width, np.float64)
+        self.world_y = np.zeros(roi_height * roi_width, np.float64)
+        self.world_tmp = np.zeros(roi_height * roi_width, np.float64)
+        self.cell_x = np.zeros(roi_height * roi_width, np.intp)
+        self.cells = np.zeros(roi_height * roi_width, np.intp)
+        self.rgba = np.zeros((source_height, source_width, 4), np.uint8)
+        self.warped = np.zeros((roi_height, roi_width, 4), np.uint8)
+        self.color_index = np.zeros((roi_height, roi_width), np.intp)
+        self.classes = np.zeros((roi_height, roi_width), np.uint8)
+        self.selects = [np.zeros((roi_height, roi_width), np.uint8) for _ in range(3)]
+        self.alpha = np.zeros((roi_height, roi_width), np.uint8)
+        self.vision = np.zeros((roi_height, roi_width, 3), np.uint8)
+        # Pixels of the warped region that get camera data (flat indices). It depends only
+        # on the remap table: these are the pixels mask_unseen keeps
+        self.view_pixels = np.flatnonzero(self.warp(np.zeros(img_shape, np.uint8))[:, :, 3])
+        # Reliability of each of those pixels for the occupancy grid: far away pixels are
+        # stretched the most by the warp, their weight goes down to far_weight at the mask edge
+        self.pixel_weights = 1 - (1 - far_weight) * np.minimum(self.dists[self.view_pixels] / distance, 1)
+
+    # Perspective transform and distance mask in one go, for the region of interest only.
+    # The result has an extra (unused) alpha channel so each pixel is exactly 4 bytes
+    def warp(self, img):
+        cv2.cvtColor(img[self.source_roi], cv2.COLOR_RGB2RGBA, dst=self.rgba)
+        return cv2.remap(self.rgba, self.map_x, self.map_y, cv2.INTER_LINEAR,
+                         dst=self.warped, borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+
+    # Classify every pixel of the warped image in a single table lookup.
+    # Returns an image of class values (see OBSTACLE, SAMPLE and NAVIGABLE)
+    def classify(self, warped):
+        np.bitwise_and(warped.view('<u4')[:, :, 0], 0xFFFFFF, out=self.color_index)
+        # Every 24 bit index is in the table: mode='clip' only keeps np.take from staging a temporary
+        return np.take(self.class_lut, self.color_index, out=self.classes, mode='clip')
+
+    # Obstacle, sample and navigable masks (0 or 255) for an image of classes
+    def class_masks(self, classes):
+        for lut, select in zip(self.mask_luts, self.selects):
+            cv2.LUT(classes, lut, dst=select)
+        return self.selects
+
+    # Clear select where the warped image has no camera data: outside the distance mask
+    # or outside the camera view. Those pixels are black, which would read as obstacle,
+    # but nothing has been seen there
+    def mask_unseen(self, warped, select):
+        cv2.extractChannel(warped, 3, dst=self.alpha)
+        cv2.threshold(self.alpha, 0, 255, cv2.THRESH_BINARY, dst=self.alpha)
+        return cv2.bitwise_and(select, self.alpha, dst=select)
+
+    # World map cell (flat index y * world_size + x) hit by every pixel of the warped image.
+    # Same arithmetic as pix_to_world, done once for the whole image whatever the pixel class
+    def world_cells(self, xpos, ypos, yaw):
+        yaw_rad = np.deg2rad(yaw)
+        cos_yaw = np.cos(yaw_rad)
+        sin_yaw = np.sin(yaw_rad)
+        # Apply rotation
+        np.multiply(self.rover_x, cos_yaw, out=self.world_x)
+        np.multiply(self.rover_y, sin_yaw, out=self.world_tmp)
+        np.subtract(self.world_x, self.world_tmp, out=self.world_x)
+        np.multiply(self.rover_x, sin_yaw, out=self.world_y)
+        np.multiply(self.rover_y, cos_yaw, out=self.world_tmp)
+        np.add(self.world_y, self.world_tmp, out=self.world_y)
+        # Apply scaling and translation
+        np.divide(self.world_x, self.scale, out=self.world_x)
+        np.add(self.world_x, xpos, out=self.world_x)
+        np.divide(self.world_y, self.scale, out=self.world_y)
+        np.add(self.world_y, ypos, out=self.world_y)
+        # Truncate and clip to the map, as np.int_ and np.clip do in pix_to_world
+        np.copyto(self.cell_x, self.world_x, casting='unsafe')
+        np.clip(self.cell_x, 0, self.world_size - 1, out=self.cell_x)
+        np.copyto(self.cells, self.world_y, casting='unsafe')
+        np.clip(self.cells, 0, self.world_size - 1, out=self.cells)
+        np.multiply(self.cells, self.world_size, out=self.cells)
+        np.add(self.cells, self.cell_x, out=self.cells)
+        return self.cells
+
+    # Observe a batch of frames: images is (N, height, width, 3) and the poses are arrays of N.
+    # Frames are processed in chunks of chunk_size as stacked arrays: the classes of every pixel
+    # in view and their world cells are computed for the whole chunk. Frames the occupancy grid
+    # gives no weight (tilted too much) are skipped, as perception_step does.
+    # With first, the frames are images[first:first + N]. They are still read one chunk at a time,
+    # so a shard of a memory mapped recording is never copied whole.
+    # Returns the rock sample hit counts of all frames (one per map cell) and the log-odds
+    # changes of every chunk, in order, as a list of (frames, cells, deltas) from chunk_deltas
+    def observe_frames(self, images, xpos, ypos, yaw, pitch, roll, occupancy, chunk_size=8, first=0):
+        xpos, ypos, yaw = (np.asarray(values, np.float64) for values in (xpos, ypos, yaw))
+        source_height, source_width = self.rgba.shape[:2]
+        # Only pixels with camera data are mapped
+        in_view = self.view_pixels
+        rover_x = self.rover_x[in_view]
+        rover_y = self.rover_y[in_view]
+        sample_counts = np.zeros(self.world_size * self.world_size, np.int64)
+        updates = []
+        tilt = occupancy.tilt_weight(np.asarray(pitch, np.float64), np.asarray(roll, np.float64))
+        frames = np.flatnonzero(tilt > 0)
+        for start in range(0, len(frames), chunk_size):
+            chunk = frames[start:start + chunk_size]
+            # Warp the region of interest of every frame of the chunk into one stacked RGBA array
+            source = np.ascontiguousarray(images[first + chunk][(slice(None),) + self.source_roi])
+            rgba = cv2.cvtColor(source.reshape(-1, source_width, 3), cv2.COLOR_RGB2RGBA)
+            rgba = rgba.reshape(len(chunk), source_height, source_width, 4)
+            warped = np.empty((len(chunk),) + self.warped.shape, np.uint8)
+            for frame in range(len(chunk)):
+                cv2.remap(rgba[frame], self.map_x, self.map_y, cv2.INTER_LINEAR,
+                          dst=warped[frame], borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+            pixels = warped.reshape(len(chunk), -1, 4)[:, in_view]
+            classes = self.class_lut[pixels.view('<u4')[:, :, 0] & 0xFFFFFF]
+            # World cells of every pixel in view of every frame, as world_cells computes them
+            yaw_rad = np.deg2rad(yaw[chunk])[:, None]
+            cos_yaw = np.cos(yaw_rad)
+            sin_yaw = np.sin(yaw_rad)
+            world_x = (rover_x * cos_yaw - rover_y * sin_yaw) / self.scale + xpos[chunk, None]
+            world_y = (rover_x * sin_yaw + rover_y * cos_yaw) / self.scale + ypos[chunk, None]
+            cell_x = np.clip(world_x.astype(np.intp), 0, self.world_size - 1)
+            cells = np.clip(world_y.astype(np.intp), 0, self.world_size - 1) * self.world_size + cell_x
+            sample_counts += np.bincount(cells[(classes & SAMPLE) > 0], minlength=len(sample_counts))
+            updates.append(occupancy.chunk_deltas(cells, classes, self.pixel_weights * tilt[chunk, None]))
+        return sample_counts, updates
+
+    # Map a batch of frames at once (see observe_frames). Adds them to worldmap and occupancy
+    # (and map_stats if given), with the same result as running perception_step on every frame in turn
+    def map_frames(self, images, xpos, ypos, yaw, pitch, roll, worldmap, occupancy, map_stats=None,
+                   chunk_size=8):
+        sample_counts, updates = self.observe_frames(images, xpos, ypos, yaw, pitch, roll, occupancy, chunk_size)
+        return add_observations(worldmap, occupancy, sample_counts, updates, map_stats)
+
+
 # Apply the above functions in succession and update the Rover state accordingly
 def perception_step(Rover):
     # Perform perception steps to update Rover()
     # NOTE: camera image is coming to you in Rover.img
     img = Rover.img
-    # 1) Define source and destination points for perspective transform
-    dst_size = 5
-    bottom_offset = 6
-    source = np.float32([[14, 140], [301, 140], [200, 96], [118, 96]])
-    destination = np.float32([[img.shape[1]/2 - dst_size, img.shape[0] - bottom_offset],
-                              [img.shape[1]/2 + dst_size, img.shape[0] - bottom_offset],
-                              [img.shape[1]/2 + dst_size, img.shape[0] - 2*dst_size - bottom_offset],
-                              [img.shape[1]/2 - dst_size, img.shape[0] - 2*dst_size - bottom_offset],
-                              ])
-    # 2) Apply perspective transform
-    warped = perspect_transform(img, source, destination)
-    # mask far away pixels as they are more distorted
-    distance = 120
-    height, width, depth = warped.shape
-    circle_img = np.zeros((height, width), np.uint8)
-    cv2.circle(circle_img, (width // 2, height), distance, 1, thickness=-1)
-    masked_data = cv2.bitwise_and(warped, warped, mask=circle_img)
+    # 1) Source/destination points, warp matrix and distance mask are precomputed in the context
+    context = Rover.perception_context
+    # 2) Apply perspective transform and mask far away pixels as they are more distorted
+    masked_data = context.warp(img)
     # 3) Apply color threshold to identify navigable terrain/obstacles/rock samples
-    rgb_thresh = (160, 160, 160)
-    nav_select = cv2.inRange(masked_data, rgb_thresh, (255, 255, 255))
-    # threshold for rock samples
-    hsv_low_thresh = (20, 100, 100)
-    hsv_high_thresh = (30, 255, 255)
-    hsv_img = cv2.cvtColor(masked_data, cv2.COLOR_RGB2HSV)
-    sample_select = cv2.inRange(hsv_img, hsv_low_thresh, hsv_high_thresh)
     # Anything not navigable or sample is an obstacle
-    obstacle_select = cv2.bitwise_not(cv2.bitwise_or(nav_select, sample_select))
-
-    # 4) Update Rover.vision_image (this will be displayed on left side of screen)
-    Rover.vision_image[:, :, 0] = obstacle_select
-    Rover.vision_image[:, :, 1] = sample_select
-    Rover.vision_image[:, :, 2] = nav_select
-    # 5) Convert map image pixel values to rover-centric coords
-    nav_rcoord_x, nav_rcoord_y = rover_coords(nav_select)
-    sample_rcoord_x, sample_rcoord_y = rover_coords(sample_select)
-    obstacle_rcoord_x, obstacle_rcoord_y = rover_coords(obstacle_select)
-    # 6) Convert rover-centric pixel values to world coordinates
-    world_size = 200
-    scale = 10  # map scale
-    obstacle_world_coord = pix_to_world(obstacle_rcoord_x, obstacle_rcoord_y,
-                                        Rover.pos[0], Rover.pos[1], Rover.yaw, world_size, scale)
-    sample_world_coord = pix_to_world(sample_rcoord_x, sample_rcoord_y,
-                                      Rover.pos[0], Rover.pos[1], Rover.yaw, world_size, scale)
-    nav_world_coord = pix_to_world(nav_rcoord_x, nav_rcoord_y,
-                                   Rover.pos[0], Rover.pos[1], Rover.yaw, world_size, scale)
+    classes = context.classify(masked_data)
+    obstacle_select, sample_select, nav_select = context.class_masks(classes)
+    # Only what the camera actually sees can be an obstacle
+    context.mask_unseen(masked_data, obstacle_select)
+    # 4) Update Rover.vision_image (this will be displayed on left side of screen).
+    # Outside the region of interest it stays black
+    cv2.merge((obstacle_select, sample_select, nav_select), dst=context.vision)
+    Rover.vision_image[context.roi] = context.vision
+    # 5) Pixels of each class (flat indices). Their rover-centric coords are precomputed in the context
+    nav_pix = np.flatnonzero(nav_select)
+    sample_pix = np.flatnonzero(sample_select)
+    # Frames are mapped with a weight that goes down as the rover pitches and rolls,
+    # and under CPU pressure only some frames are mapped (see AdaptiveQuality)
+    tilt = Rover.occupancy.tilt_weight(Rover.pitch, Rover.roll)
+    update_map = tilt > 0 and Rover.quality.mapping_frame()
+    # 6) Convert rover-centric pixel values to world coordinates, all pixels at once.
+    # They are needed for the worldmap and to place rocks
+    if update_map or len(sample_pix) > 0:
+        world_cells = context.world_cells(Rover.pos[0], Rover.pos[1], Rover.yaw)
     # 7) Update Rover worldmap (to be displayed on right side of screen)
-    # We keep adding each time a pixel is detected as navigable or sample
-    # We need to setup a limit for the value of the channel to avoid resetting it.
-    # In this way, our pixel intensity represents a kind of certainty in the classification of that point.
-    # Update map only if rover is not pitching too much
-    pitching_limit = 1
-    if (Rover.pitch < pitching_limit) or (Rover.pitch > 360 - pitching_limit):
-        # set limit for map pixel values
-        upper_limit = np.full_like(Rover.worldmap[:, :, 0], 255)
-        # update obstacles
-        updated = Rover.worldmap[:, :, 0]
-        updated[obstacle_world_coord[1], obstacle_world_coord[0]] += 20
-        Rover.worldmap[:, :, 0] = np.minimum(updated, upper_limit)
-        # update navigable terrain
-        updated = Rover.worldmap[:, :, 2]
-        updated[nav_world_coord[1], nav_world_coord[0]] += 20
-        Rover.worldmap[:, :, 2] = np.minimum(updated, upper_limit)
-        # update rock samples
-        updated = Rover.worldmap[:, :, 1]
-        updated[sample_world_coord[1], sample_world_coord[0]] += 20
-        Rover.worldmap[:, :, 1] = np.minimum(updated, upper_limit)
+    if update_map:
+        # Rock samples: we keep adding each time a pixel is detected as sample.
+        # Values saturate at 255, so they never wrap around
+        map_cells = map_channel(Rover.worldmap, 1)
+        cells, old_values = add_hits(map_cells, world_cells[sample_pix])
+        Rover.map_stats.update(1, cells, old_values, map_cells[cells])
+        # Obstacles and navigable terrain: every pixel in view is evidence for the occupancy grid.
+        # Under CPU pressure only one pixel out of pixel_stride is used
+        stride = Rover.quality.pixel_stride()
+        view = context.view_pixels[::stride]
+        terrain_cells, deltas = Rover.occupancy.frame_deltas(world_cells[view], classes.ravel()[view],
+                                                             context.pixel_weights[::stride] * tilt)
+        Rover.occupancy.fuse(terrain_cells, deltas, Rover.worldmap, Rover.map_stats)
+        # Keep the exploration frontier and the path planner cost grid up to date
+        # with the obstacle and navigable cells that changed
+        Rover.frontier.update(Rover.worldmap, terrain_cells)
+        Rover.paths.update(Rover.worldmap, terrain_cells)
+    # Remember where we started, to return there at the end
+    if Rover.home is None:
+        Rover.home = (Rover.pos[0], Rover.pos[1])
     # let's keep a record of places visited
-    mark_size = 4  # size in pixels in the world map assumed as visited
-    x_pos = Rover.pos[0]
-    y_pos = Rover.pos[1]
-    cv2.circle(Rover.visited, (int(np.round(x_pos)), int(np.round(y_pos))), mark_size, (0, 1, 0), 1)
+    Rover.visited.mark(Rover.pos[0], Rover.pos[1])
     # Next line just for visual debugging
-    #Rover.worldmap[:, :, 2] = Rover.visited[:, :, 1]
+    #Rover.worldmap[:, :, 2] = Rover.visited.grid
 
     # 8) Convert rover-centric pixel positions to polar coordinates
-    # Update Rover pixel distances and angles
-    dist, angles = to_polar_coords(nav_rcoord_x, nav_rcoord_y)
-    Rover.nav_dists = dist
-    Rover.nav_angles = angles
-
-    # Detect if we are in sight of sample
-    # percentage of pixel in image to consider a as sample detected
-    sample_threshold = 0.008
-    if (np.sum(sample_select)) > (sample_threshold * sample_select.shape[0] * sample_select.shape[1]):
-        dist, angles = to_polar_coords(sample_rcoord_x, sample_rcoord_y)
-        Rover.sample_bearing = np.mean(angles)
-        Rover.sample_dist = np.mean(dist)
-        print('sample detected, bearing:', Rover.sample_bearing, ', distance', Rover.sample_dist)
+    # Update Rover pixel distances and angles, in place in the preallocated buffers.
+    # The indices are in range: mode='clip' only keeps np.take from staging the result in a temporary
+    Rover.nav_dists = np.take(context.dists, nav_pix, out=Rover.nav_dists_buffer[:len(nav_pix)], mode='clip')
+    Rover.nav_angles = np.take(context.angles, nav_pix, out=Rover.nav_angles_buffer[:len(nav_pix)], mode='clip')
+
+    # Detect if we are in sight of samples. Each blob of sample pixels is a rock, and the
+    # nearest one is the one to go for. Every rock in view updates the table of known rocks
+    rock_dists, rock_angles, rock_x, rock_y = find_rocks(sample_select, sample_pix, context)
+    Rover.rocks.update(rock_dists, rock_x, rock_y)
+    if len(rock_dists) > 0:
+        Rover.sample_bearing = rock_angles[0]
+        Rover.sample_dist = rock_dists[0]
+        # World position of the sample, for the path planner
+        Rover.sample_pos = (rock_x[0], rock_y[0])
+        logger.debug('sample detected, bearing: %s, distance %s', Rover.sample_bearing, Rover.sample_dist)
     else:
         Rover.sample_bearing = None
         Rover.sample_dist = None
-    # Check is rover is stuck
+        Rover.sample_pos = None
+    # Check is rover is stuck. speed_check counts seconds (not frames) without moving,
+    # so the watchdog behaves the same whatever the frame rate
+    if Rover.watchdog_time is not None:
+        elapsed = Rover.total_time - Rover.watchdog_time
+    else:
+        elapsed = 0
+    Rover.watchdog_time = Rover.total_time
     if Rover.vel < 0.1:
-        Rover.speed_check += 1
+        Rover.speed_check += elapsed
     elif Rover.vel > 0.5:
         # reset counter if rover is moving. Some hysteresis introduced to work better
         Rover.speed_check = 0
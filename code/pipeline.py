@@ -0,0 +1,212 @@
+# The per frame work of the rover and the command line options, shared by the
+# control servers (drive_rover.py on eventlet, drive_rover_async.py on asyncio).
+# Nothing here talks to the network, so both servers send exactly the same messages
+import os
+import shutil
+import signal
+import logging
+from datetime import datetime
+import numpy as np
+
+from perception import perception_step
+from decision import decision_step
+from supporting_functions import update_rover, InsetRenderer
+from instrumentation import AdaptiveQuality, FrameProfiler
+from recording import RecordingWriter, telemetry_record
+
+
+# Payload of the 'data' message with the commands for the rover
+def control_message(commands, image_string1, image_string2):
+    return {
+        'throttle': commands[0].__str__(),
+        'brake': commands[1].__str__(),
+        'steering_angle': commands[2].__str__(),
+        'inset_image1': image_string1,
+        'inset_image2': image_string2,
+        }
+
+
+# Run decoding, perception and decision on one telemetry message, timing every stage
+# (and profiling perception and decision when the profiler is on).
+# Returns the updated Rover, the (throttle, brake, steer) commands, the (map, vision)
+# inset images, whether to send the pickup command and the JPEG bytes of the camera image
+def process_frame(Rover, data, stats, renderer, profiler):
+    # Initialize / update Rover with current telemetry
+    with stats.stage('decode'):
+        Rover, image = update_rover(Rover, data)
+
+    if np.isfinite(Rover.vel):
+
+        # Execute the perception and decision steps to update the Rover's state
+        with profiler.frame():
+            with stats.stage('perception'), profiler.scope('perception'):
+                Rover = perception_step(Rover)
+            with stats.stage('decision'), profiler.scope('decision'):
+                Rover = decision_step(Rover)
+
+            # Output images to send to server are rendered in the background,
+            # here we get the most recent ones
+            images = renderer.update(Rover)
+        commands = (Rover.throttle, Rover.brake, Rover.steer)
+
+        # If in a state where want to pickup a rock send pickup command
+        pickup = Rover.send_pickup and not Rover.picking_up
+        if pickup:
+            # Reset Rover flags
+            Rover.send_pickup = False
+        return Rover, commands, images, pickup, image
+    # In case of invalid telemetry, send zeros for throttle, brake and steer and empty images
+    return Rover, (0, 0, 0), ('', ''), False, image
+
+
+# If you want to save camera images from autonomous driving specify a path
+# Example: $ python drive_rover.py image_folder_path
+# Recordings are written by a background thread, only JPEG files are written here
+def save_frame(Rover, image, recorder, image_folder):
+    if recorder is not None:
+        recorder.append(Rover.img, telemetry_record(Rover))
+    elif image_folder != '':
+        timestamp = datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f')[:-3]
+        image_filename = os.path.join(image_folder, timestamp)
+        # image holds the JPEG bytes as received, no need to encode again
+        with open('{}.jpg'.format(image_filename), 'wb') as image_file:
+            image_file.write(image)
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        'image_folder',
+        type=str,
+        nargs='?',
+        default='',
+        help='Path to image folder. This is where the images from the run will be saved.'
+    )
+    parser.add_argument(
+        '--record_format',
+        type=str,
+        choices=['jpeg', 'chunks'],
+        default='jpeg',
+        help="'jpeg' saves one JPEG file per frame, 'chunks' records frames and telemetry into memory "
+             "mappable chunk files (see recording.py) from a background thread."
+    )
+    parser.add_argument(
+        '--render_every',
+        type=int,
+        default=1,
+        help='Render the inset images at most once every this many frames.'
+    )
+    parser.add_argument(
+        '--render_hz',
+        type=float,
+        default=10,
+        help='Maximum inset image renders per second (0 for no limit).'
+    )
+    parser.add_argument(
+        '--stats_file',
+        type=str,
+        default='',
+        help='Write pipeline latency statistics to this file (.json or .csv) periodically and on exit.'
+    )
+    parser.add_argument(
+        '--stats_interval',
+        type=float,
+        default=10,
+        help='Seconds between writes of the statistics file.'
+    )
+    parser.add_argument(
+        '--frame_budget',
+        type=float,
+        default=50,
+        help='Frames taking longer than this many milliseconds are counted as late.'
+    )
+    parser.add_argument(
+        '--adaptive_quality',
+        action='store_true',
+        help='Lower the perception quality (map less often, from fewer pixels) while frames go over '
+             'frame_budget, and raise it again when there is headroom.'
+    )
+    parser.add_argument(
+        '--log_level',
+        type=str,
+        default='INFO',
+        help='Logging level. Per frame telemetry is logged at DEBUG.'
+    )
+    parser.add_argument(
+        '--scheduler',
+        type=str,
+        choices=['latest', 'fifo'],
+        default='latest',
+        help="'latest' processes only the newest telemetry and drops older messages if processing "
+             "falls behind, 'fifo' processes every message in order."
+    )
+    parser.add_argument(
+        '--profile',
+        type=str,
+        choices=['cprofile', 'tracemalloc'],
+        default=None,
+        help="Profile perception, decision and the inset images ('cprofile') or the memory allocated "
+             "by the code of this folder in the whole process ('tracemalloc') for profile_frames frames, "
+             "then switch profiling off. "
+             "Send SIGUSR1 to the server to profile another window."
+    )
+    parser.add_argument(
+        '--profile_frames',
+        type=int,
+        default=200,
+        help='Frames in each profiling window.'
+    )
+    parser.add_argument(
+        '--profile_start',
+        type=int,
+        default=0,
+        help='Frame to start the first profiling window at (-1 to wait for SIGUSR1).'
+    )
+    parser.add_argument(
+        '--profile_output',
+        type=str,
+        default='profile',
+        help='Profiling reports are written to <profile_output>_<window>.txt (and .prof files with cprofile).'
+    )
+
+
+# Set up logging, statistics, quality control, profiling, the inset renderer and the recording
+# from the command line options. Returns the renderer, the recorder (None unless recording chunks)
+# and the profiler
+def start(args, Rover, stats):
+    logging.basicConfig(level=args.log_level.upper())
+    stats.frame_budget = args.frame_budget / 1000
+    Rover.quality = AdaptiveQuality(stats.frame_budget, args.adaptive_quality, stats=stats)
+    profiler = FrameProfiler(args.profile, args.profile_frames, args.profile_output,
+                             args.profile_start if args.profile_start >= 0 else None)
+    if args.profile is not None and hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: profiler.request())
+    # Inset images are rendered off the control loop
+    renderer = InsetRenderer(args.render_every, args.render_hz, stats, profiler)
+
+    recorder = None
+    #os.system('rm -rf IMG_stream/*')
+    if args.image_folder != '':
+        print("Creating image folder at {}".format(args.image_folder))
+        if not os.path.exists(args.image_folder):
+            os.makedirs(args.image_folder)
+        else:
+            shutil.rmtree(args.image_folder)
+            os.makedirs(args.image_folder)
+        if args.record_format == 'chunks':
+            recorder = RecordingWriter(args.image_folder)
+        print("Recording this run ...")
+    else:
+        print("NOT recording this run ...")
+    return renderer, recorder, profiler
+
+
+# Stop the background workers, write out profiling in progress and report the statistics
+def stop(args, stats, renderer, recorder, profiler):
+    renderer.shutdown()
+    profiler.close()
+    if recorder is not None:
+        recorder.close()
+        print('Recorded {} frames ({} dropped)'.format(recorder.frames, recorder.dropped))
+    print(stats.report())
+    if args.stats_file != '':
+        stats.dump(args.stats_file)
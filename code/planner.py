@@ -0,0 +1,335 @@
+import heapq
+import numpy as np
+
+from mapping import map_channel
+
+
+# Wrap angles (radians) to [-pi, pi)
+def wrap_angle(angle):
+    return (angle + np.pi) % (2 * np.pi) - np.pi
+
+
+# Exploration planner. Frontier cells are known navigable cells next to a cell that
+# has never been mapped. They are kept up to date from the cells that change on each
+# frame, and a new goal is only picked when the frontier changed enough since the last one
+class FrontierPlanner():
+    def __init__(self, world_size=200, min_goal_dist=8, reach_dist=4, turn_cost=10, replan_fraction=0.1):
+        self.size = world_size
+        self.min_goal_dist = min_goal_dist  # ignore frontier cells closer than this (cells)
+        self.reach_dist = reach_dist  # goal is reached when closer than this (cells)
+        self.turn_cost = turn_cost  # cells of extra distance per radian the rover has to turn
+        self.replan_fraction = replan_fraction  # fraction of the frontier that must change to replan
+        self.navigable = np.zeros(world_size * world_size, bool)
+        # Unknown cells, with a one cell border (never unknown) so that every cell has 4 neighbours
+        self.padded_size = world_size + 2
+        self.unknown = np.zeros(self.padded_size * self.padded_size, bool)
+        self.unknown.reshape(self.padded_size, self.padded_size)[1:-1, 1:-1] = True
+        self.frontier = np.zeros(world_size * world_size, bool)
+        self.frontier_count = 0
+        self.changes_since_plan = 0
+        self.goal = None  # (x, y) world cell
+        self.plans = 0
+
+    # Update frontier for the worldmap cells (flat indices) that changed
+    def update(self, worldmap, cells):
+        if len(cells) == 0:
+            return
+        obstacle = map_channel(worldmap, 0)[cells]
+        navigable = map_channel(worldmap, 2)[cells]
+        y, x = np.divmod(cells, self.size)
+        self.navigable[cells] = (navigable > 0) & (navigable >= obstacle)
+        self.unknown[(y + 1) * self.padded_size + x + 1] = (navigable == 0) & (obstacle == 0)
+        # Frontier status can change for the cells themselves and their 4 neighbours
+        affected = np.unique(np.concatenate((cells, cells - 1, cells + 1, cells - self.size, cells + self.size)))
+        affected = affected[(affected >= 0) & (affected < self.size * self.size)]
+        y, x = np.divmod(affected, self.size)
+        padded = (y + 1) * self.padded_size + x + 1
+        unknown_near = (self.unknown[padded - 1] | self.unknown[padded + 1]
+                        | self.unknown[padded - self.padded_size] | self.unknown[padded + self.padded_size])
+        frontier = self.navigable[affected] & unknown_near
+        changed = frontier != self.frontier[affected]
+        self.frontier_count += np.count_nonzero(frontier & changed) - np.count_nonzero(~frontier & changed)
+        self.changes_since_plan += np.count_nonzero(changed)
+        self.frontier[affected] = frontier
+
+    def needs_plan(self, x_pos, y_pos):
+        if self.goal is None:
+            return self.changes_since_plan > 0
+        goal_x, goal_y = self.goal
+        return (not self.frontier[goal_y * self.size + goal_x]
+                or np.hypot(goal_x - x_pos, goal_y - y_pos) < self.reach_dist
+                or self.changes_since_plan > self.replan_fraction * self.frontier_count)
+
+    # Pick the frontier cell that is closest, counting turning as extra distance
+    def plan(self, x_pos, y_pos, yaw):
+        self.plans += 1
+        self.changes_since_plan = 0
+        self.goal = None
+        cells = np.flatnonzero(self.frontier)
+        if len(cells) == 0:
+            return
+        goal_y, goal_x = np.divmod(cells, self.size)
+        dist = np.hypot(goal_x - x_pos, goal_y - y_pos)
+        bearing = wrap_angle(np.arctan2(goal_y - y_pos, goal_x - x_pos) - np.deg2rad(yaw))
+        score = dist + self.turn_cost * np.abs(bearing)
+        score[dist < self.min_goal_dist] = np.inf
+        best = np.argmin(score)
+        if np.isfinite(score[best]):
+            self.goal = (goal_x[best], goal_y[best])
+
+    # Angle (radians, rover frame) to the current exploration goal, or None if there is none
+    def target_bearing(self, x_pos, y_pos, yaw):
+        if self.needs_plan(x_pos, y_pos):
+            self.plan(x_pos, y_pos, yaw)
+        if self.goal is None:
+            return None
+        goal_x, goal_y = self.goal
+        return wrap_angle(np.arctan2(goal_y - y_pos, goal_x - x_pos) - np.deg2rad(yaw))
+
+
+INF = float('inf')
+
+
+# D* Lite (Koenig & Likhachev) shortest paths to one goal cell on an 8-connected grid.
+# Searches backwards from the goal, so when cell costs change or the rover moves only
+# the affected part of the search is repaired instead of planning from scratch.
+# Cells are flat indices into a grid with a one cell border of impassable cells
+# (see GridPlanner), so neighbours never need bounds checks
+class DStarLite():
+    def __init__(self, grid, goal, max_expansions=20000):
+        self.grid = grid
+        self.goal = goal
+        self.max_expansions = max_expansions  # per call to plan, the search resumes on the next call
+        cells = len(grid.costs)
+        self.g = [INF] * cells
+        self.rhs = [INF] * cells
+        self.rhs[goal] = 0.0
+        self.open_list = []
+        self.open_keys = {}
+        self.km = 0.0
+        self.start = None
+        self.changed_cells = set()
+
+    def push(self, cell, key):
+        self.open_keys[cell] = key
+        heapq.heappush(self.open_list, (key[0], key[1], cell))
+
+    def key(self, cell):
+        value = min(self.g[cell], self.rhs[cell])
+        return (value + self.grid.heuristic(self.start, cell) + self.km, value)
+
+    # Put a cell on the open list if it is inconsistent, take it off otherwise
+    def queue(self, cell):
+        if self.g[cell] != self.rhs[cell]:
+            self.push(cell, self.key(cell))
+        else:
+            self.open_keys.pop(cell, None)
+
+    # Cost of the best path from a cell through one of its neighbours
+    def best_rhs(self, cell):
+        best = INF
+        g = self.g
+        costs = self.grid.costs
+        cell_cost = costs[cell]
+        for offset, step in self.grid.steps:
+            neighbour = cell + offset
+            cost = step * 0.5 * (cell_cost + costs[neighbour]) + g[neighbour]
+            if cost < best:
+                best = cost
+        return best
+
+    def update_cell(self, cell):
+        # Border cells are never expanded, their neighbours would be off the grid
+        if cell != self.goal and self.grid.costs[cell] != INF:
+            self.rhs[cell] = self.best_rhs(cell)
+        self.queue(cell)
+
+    # Expand cells until the start is consistent (or the expansion budget runs out).
+    # Neighbours are updated as in the optimized version of D* Lite: when a cell's cost
+    # goes down only the neighbours it improves change, and when it goes up only the
+    # neighbours whose best path went through it are recomputed
+    def compute(self):
+        open_list = self.open_list
+        open_keys = self.open_keys
+        g = self.g
+        rhs = self.rhs
+        costs = self.grid.costs
+        steps = self.grid.steps
+        start = self.start
+        goal = self.goal
+        for _ in range(self.max_expansions):
+            # Drop heap entries that are stale (the cell was updated or removed since)
+            while open_list and open_keys.get(open_list[0][2]) != (open_list[0][0], open_list[0][1]):
+                heapq.heappop(open_list)
+            if not open_list or ((open_list[0][0], open_list[0][1]) >= self.key(start) and rhs[start] == g[start]):
+                return True
+            k1, k2, cell = heapq.heappop(open_list)
+            del open_keys[cell]
+            new_key = self.key(cell)
+            cell_cost = costs[cell]
+            if (k1, k2) < new_key:
+                self.push(cell, new_key)
+            elif g[cell] > rhs[cell]:
+                g[cell] = g_cell = rhs[cell]
+                for offset, step in steps:
+                    neighbour = cell + offset
+                    neighbour_cost = costs[neighbour]
+                    if neighbour_cost == INF or neighbour == goal:
+                        continue
+                    cost = step * 0.5 * (cell_cost + neighbour_cost) + g_cell
+                    if cost < rhs[neighbour]:
+                        rhs[neighbour] = cost
+                        self.queue(neighbour)
+            else:
+                g_old = g[cell]
+                g[cell] = INF
+                for offset, step in steps:
+                    neighbour = cell + offset
+                    neighbour_cost = costs[neighbour]
+                    if neighbour_cost == INF or neighbour == goal:
+                        continue
+                    if rhs[neighbour] == step * 0.5 * (cell_cost + neighbour_cost) + g_old:
+                        rhs[neighbour] = self.best_rhs(neighbour)
+                        self.queue(neighbour)
+                self.queue(cell)
+        return False
+
+    # Repair the search for the current start cell and any cells whose cost changed.
+    # Returns True when shortest paths from start are known
+    def plan(self, start):
+        if self.start is None:
+            self.start = start
+            self.push(self.goal, self.key(self.goal))
+        elif start != self.start:
+            self.km += self.grid.heuristic(self.start, start)
+            self.start = start
+        if self.changed_cells:
+            # Edges to and from a changed cell have a new cost
+            affected = set(self.changed_cells)
+            for cell in self.changed_cells:
+                affected.update([cell + offset for offset, step in self.grid.steps])
+            for cell in affected:
+                self.update_cell(cell)
+            self.changed_cells.clear()
+        return self.compute()
+
+    # Follow the shortest path from start for at most max_steps cells
+    def path(self, max_steps=400):
+        cell = self.start
+        path = [cell]
+        g = self.g
+        costs = self.grid.costs
+        while cell != self.goal and len(path) <= max_steps:
+            best = INF
+            next_cell = None
+            for offset, step in self.grid.steps:
+                neighbour = cell + offset
+                cost = step * 0.5 * (costs[cell] + costs[neighbour]) + g[neighbour]
+                if cost < best:
+                    best = cost
+                    next_cell = neighbour
+            if next_cell is None:
+                return None
+            cell = next_cell
+            path.append(cell)
+        return path
+
+
+# Cost grid derived from the worldmap, and D* Lite planners to a few goals on it.
+# Planners are cached by goal and kept up to date with the worldmap cells that change,
+# so asking again for the same goal on the next frame only repairs the previous search
+class GridPlanner():
+    def __init__(self, world_size=200, navigable_cost=1.0, unknown_cost=1.5, obstacle_cost=50.0,
+                 lookahead=6, max_goals=4, max_expansions=20000):
+        self.size = world_size
+        self.padded_size = world_size + 2
+        self.navigable_cost = navigable_cost
+        self.unknown_cost = unknown_cost
+        self.obstacle_cost = obstacle_cost
+        self.lookahead = lookahead  # cells along the path to steer towards
+        self.max_goals = max_goals
+        self.max_expansions = max_expansions
+        # Cost of entering each cell. The border is impassable
+        costs = np.full((self.padded_size, self.padded_size), INF)
+        costs[1:-1, 1:-1] = unknown_cost
+        self.cost_grid = costs.ravel()
+        self.costs = self.cost_grid.tolist()  # lists are much faster than arrays to index one cell at a time
+        side = self.padded_size
+        sqrt2 = np.sqrt(2)
+        self.steps = ((-1, 1.0), (1, 1.0), (-side, 1.0), (side, 1.0),
+                      (-side - 1, sqrt2), (-side + 1, sqrt2), (side - 1, sqrt2), (side + 1, sqrt2))
+        self.planners = {}
+        self.paths = {}
+
+    # Octile distance times the cheapest cell cost, never more than the real path cost
+    def heuristic(self, cell_a, cell_b):
+        y_a, x_a = divmod(cell_a, self.padded_size)
+        y_b, x_b = divmod(cell_b, self.padded_size)
+        dx = abs(x_a - x_b)
+        dy = abs(y_a - y_b)
+        return self.navigable_cost * (max(dx, dy) + 0.41421356 * min(dx, dy))
+
+    # Grid cell for world coordinates (x, y)
+    def cell(self, x_pos, y_pos):
+        x = min(max(int(x_pos), 0), self.size - 1)
+        y = min(max(int(y_pos), 0), self.size - 1)
+        return (y + 1) * self.padded_size + x + 1
+
+    # World coordinates of the center of a grid cell
+    def position(self, cell):
+        y, x = divmod(cell, self.padded_size)
+        return x - 0.5, y - 0.5
+
+    # Update cell costs for the worldmap cells (flat indices) that changed
+    def update(self, worldmap, cells):
+        if len(cells) == 0:
+            return
+        obstacle = map_channel(worldmap, 0)[cells]
+        navigable = map_channel(worldmap, 2)[cells]
+        costs = np.where(navigable >= obstacle, self.navigable_cost, self.obstacle_cost)
+        costs[(navigable == 0) & (obstacle == 0)] = self.unknown_cost
+        y, x = np.divmod(cells, self.size)
+        padded = (y + 1) * self.padded_size + x + 1
+        # Only cells whose cost changed need the (python) lists and the searches updated
+        different = self.cost_grid[padded] != costs
+        if np.any(different):
+            changed = padded[different]
+            self.cost_grid[changed] = costs[different]
+            changed = changed.tolist()
+            for cell, cost in zip(changed, costs[different].tolist()):
+                self.costs[cell] = cost
+            for planner in self.planners.values():
+                planner.changed_cells.update(changed)
+            self.paths.clear()
+
+    # D* Lite planner for a goal (grid cell), reusing the cached one if there is one
+    def planner(self, goal):
+        if goal not in self.planners:
+            if len(self.planners) >= self.max_goals:
+                # Forget the oldest goal
+                del self.planners[next(iter(self.planners))]
+            self.planners[goal] = DStarLite(self, goal, self.max_expansions)
+        return self.planners[goal]
+
+    # Path (list of grid cells) from world position to world goal, None while still searching.
+    # Paths are cached until the rover changes cell or the map changes
+    def path(self, x_pos, y_pos, goal_x, goal_y):
+        start = self.cell(x_pos, y_pos)
+        goal = self.cell(goal_x, goal_y)
+        if (start, goal) in self.paths:
+            return self.paths[(start, goal)]
+        planner = self.planner(goal)
+        if not planner.plan(start):
+            return None
+        path = planner.path()
+        self.paths = {(start, goal): path}
+        return path
+
+    # Angle (radians, rover frame) to a point a few cells along the path to the goal,
+    # or None if there is no path yet
+    def bearing(self, x_pos, y_pos, yaw, goal_x, goal_y):
+        path = self.path(x_pos, y_pos, goal_x, goal_y)
+        if not path:
+            return None
+        target_x, target_y = self.position(path[min(self.lookahead, len(path) - 1)])
+        return wrap_angle(np.arctan2(target_y - y_pos, target_x - x_pos) - np.deg2rad(yaw))
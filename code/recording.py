@@ -0,0 +1,173 @@
+# Recording of autonomous runs: camera frames plus the rover state on every frame,
+# stored raw in chunk files so they can be read back with np.memmap, frame by frame
+# or in any order, without decoding images.
+#
+# A recording is a folder with:
+#   recording.json        frame shape, frames per chunk and the telemetry record fields
+#   frames_NNNNN.bin      up to chunk_frames frames, uint8 (height, width, 3) each
+#   telemetry_NNNNN.bin   one TELEMETRY_DTYPE record per frame of the same chunk
+# Files are only ever appended to, and the number of frames is read from the file sizes,
+# so a recording that was cut short is still readable
+import json
+import os
+import queue
+import threading
+import numpy as np
+
+# Rover state saved with every frame. Commands are the ones sent to the rover on that frame
+TELEMETRY_DTYPE = np.dtype([('time', '<f8'),  # seconds since the start of the run
+                            ('x', '<f8'), ('y', '<f8'),  # position
+                            ('yaw', '<f8'), ('pitch', '<f8'), ('roll', '<f8'),
+                            ('vel', '<f8'),
+                            ('throttle', '<f8'), ('brake', '<f8'), ('steer', '<f8'),
+                            ('near_sample', '<i1'), ('picking_up', '<i1'), ('samples_found', '<i2'),
+                            ('mode', 'S8')])
+
+# Names of the robot_log.csv columns for telemetry fields, so recordings can be replayed
+# with the same code as simulator training logs
+LOG_COLUMNS = {'Time': 'time', 'X_Position': 'x', 'Y_Position': 'y', 'Yaw': 'yaw', 'Pitch': 'pitch',
+               'Roll': 'roll', 'Speed': 'vel', 'Throttle': 'throttle', 'Brake': 'brake', 'SteerAngle': 'steer'}
+
+
+def chunk_path(path, kind, chunk):
+    return os.path.join(path, '{}_{:05d}.bin'.format(kind, chunk))
+
+
+def is_recording(path):
+    return os.path.isfile(os.path.join(path, 'recording.json'))
+
+
+# Telemetry record of the current rover state
+def telemetry_record(Rover):
+    record = np.zeros((), TELEMETRY_DTYPE)
+    record['time'] = Rover.total_time
+    record['x'], record['y'] = Rover.pos[0], Rover.pos[1]
+    for field in ('yaw', 'pitch', 'roll', 'vel', 'throttle', 'brake', 'steer',
+                  'near_sample', 'picking_up', 'samples_found'):
+        record[field] = getattr(Rover, field)
+    record['mode'] = Rover.mode.encode()[:8]
+    return record
+
+
+# Append frames to a recording from a background thread, so the run loop never waits for
+# the disk. append copies the frame and returns immediately. If the writer falls more than
+# queue_size frames behind, new frames are dropped (and counted) rather than waited for
+class RecordingWriter():
+    def __init__(self, path, chunk_frames=256, queue_size=64):
+        self.path = path
+        self.chunk_frames = chunk_frames
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.frames = 0
+        self.dropped = 0
+        self.frame_file = None
+        self.telemetry_file = None
+        os.makedirs(path, exist_ok=True)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # Queue a frame (the camera image) and its telemetry record. Returns False if it was dropped
+    def append(self, img, record):
+        try:
+            self.queue.put_nowait((img.copy(), record))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            img, record = item
+            if self.frames == 0:
+                self.write_header(img.shape)
+            if self.frames % self.chunk_frames == 0:
+                self.close_files()
+                chunk = self.frames // self.chunk_frames
+                self.frame_file = open(chunk_path(self.path, 'frames', chunk), 'ab')
+                self.telemetry_file = open(chunk_path(self.path, 'telemetry', chunk), 'ab')
+            self.frame_file.write(np.ascontiguousarray(img, np.uint8).tobytes())
+            self.telemetry_file.write(record.tobytes())
+            self.frames += 1
+        self.close_files()
+
+    def write_header(self, frame_shape):
+        header = {'frame_shape': list(frame_shape), 'chunk_frames': self.chunk_frames,
+                  'telemetry_fields': [list(field) for field in TELEMETRY_DTYPE.descr]}
+        with open(os.path.join(self.path, 'recording.json'), 'w') as header_file:
+            json.dump(header, header_file, indent=2)
+
+    def close_files(self):
+        for open_file in (self.frame_file, self.telemetry_file):
+            if open_file is not None:
+                open_file.close()
+
+    # Write out every queued frame and stop the writer thread. If the thread died (on a write
+    # error), the queue may stay full: waiting to queue the stop stops with it, so this never hangs.
+    # At most timeout seconds are waited for the writer to finish
+    def close(self, timeout=10):
+        while self.thread.is_alive():
+            try:
+                self.queue.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        self.thread.join(timeout)
+
+
+# Read only view of a recording. Frames are memory mapped: recording[i] is frame i,
+# recording[indices] (a slice or an array of indices) a stacked copy of those frames.
+# recording.telemetry holds the TELEMETRY_DTYPE records of all frames
+class Recording():
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'recording.json')) as header_file:
+            header = json.load(header_file)
+        self.frame_shape = tuple(header['frame_shape'])
+        self.chunk_frames = header['chunk_frames']
+        frame_size = int(np.prod(self.frame_shape))
+        self.chunks = []
+        telemetry = []
+        chunk = 0
+        while os.path.isfile(chunk_path(path, 'frames', chunk)):
+            # A chunk that was being written when the run stopped may hold a partial frame at the end
+            frames = min(os.path.getsize(chunk_path(path, 'frames', chunk)) // frame_size,
+                         os.path.getsize(chunk_path(path, 'telemetry', chunk)) // TELEMETRY_DTYPE.itemsize)
+            if frames == 0:
+                break
+            self.chunks.append(np.memmap(chunk_path(path, 'frames', chunk), np.uint8, 'r',
+                                         shape=(frames,) + self.frame_shape))
+            telemetry.append(np.fromfile(chunk_path(path, 'telemetry', chunk), TELEMETRY_DTYPE, frames))
+            chunk += 1
+        self.telemetry = np.concatenate(telemetry) if telemetry else np.zeros(0, TELEMETRY_DTYPE)
+        self.shape = (len(self.telemetry),) + self.frame_shape
+
+    def __len__(self):
+        return len(self.telemetry)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            index = np.arange(len(self))[index]
+        # Negative indices count from the end, as for arrays
+        index = np.asarray(index)
+        index = np.where(index < 0, index + len(self), index)
+        if np.any((index < 0) | (index >= len(self))):
+            raise IndexError('frame index out of range for a recording of {} frames'.format(len(self)))
+        if index.ndim == 0:
+            chunk, offset = divmod(int(index), self.chunk_frames)
+            return self.chunks[chunk][offset]
+        chunks, offsets = np.divmod(index, self.chunk_frames)
+        frames = np.empty((len(offsets),) + self.frame_shape, np.uint8)
+        for chunk in np.unique(chunks):
+            selected = chunks == chunk
+            frames[selected] = self.chunks[chunk][offsets[selected]]
+        return frames
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            yield from chunk
+
+    # Telemetry as robot_log.csv style rows (see LOG_COLUMNS)
+    def log_rows(self):
+        return [{column: record[field] for column, field in LOG_COLUMNS.items()} for record in self.telemetry]
@@ -0,0 +1,128 @@
+# Drive the full pipeline (perception, decision and output images) from a recorded run,
+# without the simulator, as fast as possible.
+# Run it from the code folder: python replay.py ../test_dataset/robot_log.csv
+import argparse
+import base64
+import csv
+import os
+import time
+from datetime import datetime
+import numpy as np
+from PIL import Image
+
+from perception import perception_step
+from decision import decision_step
+from supporting_functions import create_output_images
+from rover_state import RoverState
+from instrumentation import PipelineStats, AdaptiveQuality
+from recording import Recording, is_recording
+
+
+# Simulator images are named robocam_YYYY_MM_DD_HH_MM_SS_mmm.jpg
+def frame_timestamp(image_path):
+    stamp = os.path.splitext(os.path.basename(image_path))[0][len('robocam_'):]
+    return datetime.strptime(stamp, '%Y_%m_%d_%H_%M_%S_%f').timestamp()
+
+
+# Read the semicolon separated log written by the simulator in training mode.
+# Image paths are looked up in the IMG folder next to the log, and the time of
+# each frame (column Time) is read from the image name
+def read_log(log_path):
+    image_folder = os.path.join(os.path.dirname(log_path), 'IMG')
+    frames = []
+    with open(log_path) as log_file:
+        for row in csv.DictReader(log_file, delimiter=';'):
+            row['Path'] = os.path.join(image_folder, os.path.basename(row['Path']))
+            row['Time'] = frame_timestamp(row['Path'])
+            frames.append(row)
+    return frames
+
+
+# Log rows and camera images of a recorded run: either a robot_log.csv (its images are decoded
+# here) or a recording folder written by drive_rover.py --record_format chunks (its frames are
+# memory mapped)
+def load_run(path):
+    if is_recording(path):
+        recording = Recording(path)
+        return recording.log_rows(), recording
+    frames = read_log(path)
+    return frames, [np.asarray(Image.open(row['Path'])) for row in frames]
+
+
+# Telemetry message (as the simulator sends it) for one log row and the JPEG bytes of its image
+def telemetry_message(row, jpeg):
+    return {'speed': str(row['Speed']), 'position': '{};{}'.format(row['X_Position'], row['Y_Position']),
+            'yaw': str(row['Yaw']), 'pitch': str(row['Pitch']), 'roll': str(row['Roll']),
+            'throttle': str(row['Throttle']), 'steering_angle': str(row['SteerAngle']),
+            'brake': str(row['Brake']), 'near_sample': '0', 'picking_up': '0', 'sample_count': '6',
+            'samples_x': '100;50;120;80;30;150', 'samples_y': '80;100;20;60;120;90',
+            'image': base64.b64encode(jpeg).decode('utf-8')}
+
+
+# Set the rover state from one row of the log, as update_rover does with telemetry
+def update_rover_from_log(Rover, row, img, start_time):
+    Rover.total_time = float(row['Time']) - start_time
+    Rover.vel = float(row['Speed'])
+    Rover.pos = [float(row['X_Position']), float(row['Y_Position'])]
+    Rover.yaw = float(row['Yaw'])
+    Rover.pitch = float(row['Pitch'])
+    Rover.roll = float(row['Roll'])
+    Rover.throttle = float(row['Throttle'])
+    Rover.steer = float(row['SteerAngle'])
+    Rover.img = img
+    return Rover
+
+
+# Run the pipeline on every frame. With a quality_budget (seconds), perception quality
+# adapts to it as in drive_rover.py --adaptive_quality
+def replay(frames, images, produce_output=True, quality_budget=0):
+    Rover = RoverState()
+    # There are no sample positions in a training log
+    Rover.samples_pos = (np.int_([]), np.int_([]))
+    start_time = float(frames[0]['Time'])
+    stats = PipelineStats()
+    if quality_budget > 0:
+        stats.frame_budget = quality_budget
+        Rover.quality = AdaptiveQuality(quality_budget, True, stats=stats)
+    start = time.perf_counter()
+    for row, img in zip(frames, images):
+        with stats.frame():
+            Rover = update_rover_from_log(Rover, row, img, start_time)
+            with stats.stage('perception'):
+                Rover = perception_step(Rover)
+            with stats.stage('decision'):
+                Rover = decision_step(Rover)
+            if produce_output:
+                with stats.stage('output'):
+                    create_output_images(Rover)
+        Rover.quality.record(stats.last_frame)
+    total = time.perf_counter() - start
+    return Rover, total, stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a recorded run through the rover pipeline')
+    parser.add_argument('log', type=str, nargs='?', default='../test_dataset/robot_log.csv',
+                        help='Path to robot_log.csv (images are read from the IMG folder next to it) '
+                             'or to a recording folder written by drive_rover.py --record_format chunks.')
+    parser.add_argument('--repeat', type=int, default=1, help='Number of times to replay the run.')
+    parser.add_argument('--no_output', action='store_true', help='Skip creating the output images.')
+    parser.add_argument('--stats_file', type=str, default='',
+                        help='Write the stage latency statistics of the last run to this file (.json or .csv).')
+    parser.add_argument('--quality_budget', type=float, default=0,
+                        help='Adapt perception quality to this frame budget in milliseconds (0 for full quality).')
+    args = parser.parse_args()
+
+    # Images are decoded up front so only the pipeline is timed
+    load_start = time.perf_counter()
+    frames, images = load_run(args.log)
+    print('Loaded {} frames in {:.2f} s'.format(len(frames), time.perf_counter() - load_start))
+
+    for run in range(args.repeat):
+        Rover, total, stats = replay(frames, images, not args.no_output, args.quality_budget / 1000)
+        print('Run {}: {:.1f} frames/s ({:.2f} ms/frame)'.format(
+            run + 1, len(frames) / total, 1000 * total / len(frames)))
+        print(stats.report())
+        if args.stats_file != '':
+            stats.dump(args.stats_file)
+        print('  Mapped: {}%  Fidelity: {}%'.format(Rover.map_stats.perc_mapped(), Rover.map_stats.fidelity()))
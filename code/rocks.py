@@ -0,0 +1,108 @@
+import numpy as np
+import cv2
+
+
+# Rocks in view: one per connected blob of at least min_area sample pixels, so two rocks
+# in view are two detections instead of one averaged in between.
+# sample_pix are the flat indices of the sample pixels, and the context must hold the world
+# coordinates of the current frame (PerceptionContext.world_cells was called).
+# Returns the mean distance, angle and world position of each rock, nearest rock first
+def find_rocks(sample_select, sample_pix, context, min_area=2, join_size=5, streak_angle=0.05):
+    empty = np.zeros(0)
+    if len(sample_pix) == 0:
+        return empty, empty, empty, empty
+    # Small gaps between sample pixels are closed before labeling, and areas and means
+    # are computed over the sample pixels themselves
+    joined = cv2.dilate(sample_select, np.ones((join_size, join_size), np.uint8))
+    count, labels = cv2.connectedComponents(joined, connectivity=8)
+    blob = labels.reshape(-1)[sample_pix]
+    area = np.bincount(blob, minlength=count)
+    # Label 0 is the background
+    rocks = np.flatnonzero(area >= min_area)
+    rocks = rocks[rocks > 0]
+    if len(rocks) == 0:
+        return empty, empty, empty, empty
+
+    # Per blob means of the precomputed per pixel values
+    def blob_mean(values):
+        return np.bincount(blob, weights=values[sample_pix], minlength=count)[rocks] / area[rocks]
+
+    dists = blob_mean(context.dists)
+    angles = blob_mean(context.angles)
+    order = np.argsort(dists)
+    # The warp stretches the top of a rock into blobs further away on the same bearing.
+    # Only the nearest blob on each bearing (the base of the rock) is kept
+    kept = []
+    for rock in order:
+        if all(abs(angles[rock] - angles[other]) > streak_angle for other in kept):
+            kept.append(rock)
+    return dists[kept], angles[kept], blob_mean(context.world_x)[kept], blob_mean(context.world_y)[kept]
+
+
+# World positions of the rocks seen so far. Detections closer than merge_dist (m) to a known
+# rock update it, others add a new candidate. A candidate is trusted once it has been seen on
+# min_confidence frames. Rocks picked up (or found not to be there) are marked as collected.
+# Far away rocks are placed meters off by the perspective warp, so only detections closer
+# than max_range (rover-centric pixels, as find_rocks distances) are tracked
+class RockTracker():
+    def __init__(self, merge_dist=2, min_confidence=3, max_weight=20, max_range=60, capacity=16):
+        self.merge_dist = merge_dist
+        self.max_range = max_range
+        self.min_confidence = min_confidence
+        self.max_weight = max_weight  # the position averages at most this many detections
+        self.positions = np.zeros((capacity, 2))
+        self.confidence = np.zeros(capacity, np.int64)
+        self.collected = np.zeros(capacity, bool)
+        self.count = 0
+
+    def update(self, dists, world_x, world_y):
+        in_range = dists < self.max_range
+        for x, y in zip(world_x[in_range], world_y[in_range]):
+            if self.count > 0:
+                rock_dists = np.hypot(self.positions[:self.count, 0] - x, self.positions[:self.count, 1] - y)
+                rock = np.argmin(rock_dists)
+                if rock_dists[rock] < self.merge_dist:
+                    # Running mean of the detections
+                    weight = min(self.confidence[rock], self.max_weight)
+                    self.positions[rock] += (np.array((x, y)) - self.positions[rock]) / (weight + 1)
+                    self.confidence[rock] += 1
+                    continue
+            if self.count == len(self.positions):
+                # Double the capacity (at least one more rock)
+                grow = max(len(self.positions), 1)
+                self.positions = np.concatenate((self.positions, np.zeros((grow, 2))))
+                self.confidence = np.concatenate((self.confidence, np.zeros(grow, np.int64)))
+                self.collected = np.concatenate((self.collected, np.zeros(grow, bool)))
+            self.positions[self.count] = (x, y)
+            self.confidence[self.count] = 1
+            self.count += 1
+
+    # Positions (N x 2) of the trusted rocks, collected or not
+    def found(self):
+        return self.positions[:self.count][self.confidence[:self.count] >= self.min_confidence]
+
+    # Nearest trusted rock not collected yet, closer than max_dist: (x, y, distance) or None
+    def nearest(self, x, y, max_dist=np.inf):
+        pending = np.flatnonzero((self.confidence[:self.count] >= self.min_confidence)
+                                 & ~self.collected[:self.count])
+        if len(pending) == 0:
+            return None
+        dists = np.hypot(self.positions[pending, 0] - x, self.positions[pending, 1] - y)
+        rock = np.argmin(dists)
+        if dists[rock] >= max_dist:
+            return None
+        return self.positions[pending[rock], 0], self.positions[pending[rock], 1], dists[rock]
+
+    # Mark the rocks closer than dist (m) to (x, y) as collected
+    def collect(self, x, y, dist):
+        dists = np.hypot(self.positions[:self.count, 0] - x, self.positions[:self.count, 1] - y)
+        self.collected[:self.count][dists < dist] = True
+
+    # Independent copy of the table, with the same capacity
+    def snapshot(self):
+        tracker = RockTracker(self.merge_dist, self.min_confidence, self.max_weight, self.max_range, 0)
+        tracker.positions = self.positions.copy()
+        tracker.confidence = self.confidence.copy()
+        tracker.collected = self.collected.copy()
+        tracker.count = self.count
+        return tracker
@@ -0,0 +1,105 @@
+import numpy as np
+import cv2
+
+from perception import PerceptionContext
+from mapping import MapStats, VisitedMap, OccupancyGrid
+from planner import FrontierPlanner, GridPlanner
+from rocks import RockTracker
+from instrumentation import AdaptiveQuality
+
+# Read in ground truth map and create 3-channel green version for overplotting
+# NOTE: images are read in by default with the origin (0, 0) in the upper left
+# and y-axis increasing downward.
+# The map is black and white: cv2 reads it as 0 or 255, without importing matplotlib
+ground_truth = cv2.imread('../calibration_images/map_bw.png', cv2.IMREAD_GRAYSCALE)
+if ground_truth is None:
+    raise FileNotFoundError('../calibration_images/map_bw.png not found, run from the code folder')
+# This next line creates arrays of zeros in the red and blue channels
+# and puts the map into the green channel.  This is why the underlying 
+# map output looks green in the display image
+ground_truth_3d = np.dstack((ground_truth*0, ground_truth, ground_truth*0))
+
+# Define RoverState() class to retain rover state parameters.
+# Fields are slotted: the state is compact and a misspelled field is an error instead of a new attribute
+class RoverState():
+    __slots__ = ('start_time', 'total_time', 'img', 'pos', 'yaw', 'pitch', 'roll', 'vel',
+                 'steer', 'throttle', 'brake', 'nav_angles', 'nav_dists', 'nav_angles_buffer', 'nav_dists_buffer',
+                 'ground_truth', 'mode', 'throttle_set', 'brake_set', 'stop_forward', 'go_forward', 'max_vel',
+                 'vision_image', 'worldmap', 'visited', 'frontier', 'frontier_weight',
+                 'paths', 'home', 'returning', 'map_goal', 'home_dist', 'home_weight',
+                 'samples_pos', 'samples_to_find', 'samples_found', 'near_sample', 'picking_up', 'send_pickup',
+                 'sample_bearing', 'sample_dist', 'sample_pos', 'rocks', 'rock_pursuit_dist', 'rock_reach_dist',
+                 'speed_check', 'watchdog_time', 'stuck_time', 'unstuck_time', 'pick_up_samples',
+                 'perception_context', 'occupancy', 'map_stats', 'quality')
+
+    def __init__(self):
+        self.start_time = None # To record the start time of navigation
+        self.total_time = None # To record total duration of navigation
+        self.img = None # Current camera image
+        self.pos = None # Current position (x, y)
+        self.yaw = None # Current yaw angle
+        self.pitch = None # Current pitch angle
+        self.roll = None # Current roll angle
+        self.vel = None # Current velocity
+        self.steer = 0 # Current steering angle
+        self.throttle = 0 # Current throttle value
+        self.brake = 0 # Current brake value
+        self.nav_angles = None # Angles of navigable terrain pixels
+        self.nav_dists = None # Distances of navigable terrain pixels
+        self.ground_truth = ground_truth_3d # Ground truth worldmap
+        self.mode = 'forward' # Current mode (can be forward or stop)
+        self.throttle_set = 0.2 # Throttle setting when accelerating
+        self.brake_set = 5 # Brake setting when braking
+        # The stop_forward and go_forward fields below represent total count
+        # of navigable terrain pixels.  This is a very crude form of knowing
+        # when you can keep going and when you should stop.  Feel free to
+        # get creative in adding new fields or modifying these!
+        self.stop_forward = 50 # Threshold to initiate stopping
+        self.go_forward = 500 # Threshold to go forward again
+        self.max_vel = 2 # Maximum velocity (meters/second)
+        # Image output from perception step
+        # Update this image to display your intermediate analysis steps
+        # on screen in autonomous mode
+        self.vision_image = np.zeros((160, 320, 3), dtype=np.uint8)
+        # nav_angles and nav_dists are views of the first (number of navigable pixels) entries
+        # of these buffers, filled in place by perception_step on every frame
+        self.nav_angles_buffer = np.zeros(self.vision_image.shape[0] * self.vision_image.shape[1])
+        self.nav_dists_buffer = np.zeros(self.vision_image.shape[0] * self.vision_image.shape[1])
+        # Worldmap
+        # Update this image with the positions of navigable terrain
+        # obstacles and rock samples
+        self.worldmap = np.zeros((200, 200, 3), dtype=np.uint8)
+        # Log-odds of every cell being an obstacle, shown in the obstacle and navigable worldmap channels
+        self.occupancy = OccupancyGrid(self.worldmap.shape[0])
+        # Another map to keep visited places
+        self.visited = VisitedMap(self.worldmap.shape[0])
+        # Frontier of the explored map and exploration goal
+        self.frontier = FrontierPlanner(self.worldmap.shape[0])
+        self.frontier_weight = 0.3  # how much steering pulls towards the exploration goal
+        # Shortest paths over the worldmap, to go back home and to reach samples
+        self.paths = GridPlanner(self.worldmap.shape[0])
+        self.home = None  # Starting position, set on the first frame
+        self.returning = False  # Set when it is time to go back home
+        self.map_goal = 95  # % of the map to cover before going back home
+        self.home_dist = 3  # Distance (m) to home to consider we are back
+        self.home_weight = 0.6  # how much steering pulls towards the path home
+        self.samples_pos = None # To store the actual sample positions
+        self.samples_to_find = 0 # To store the initial count of samples
+        self.samples_found = 0 # To count the number of samples found
+        self.near_sample = 0 # Will be set to telemetry value data["near_sample"]
+        self.picking_up = 0 # Will be set to telemetry value data["picking_up"]
+        self.send_pickup = False # Set to True to trigger rock pickup
+        self.sample_bearing = None # Mean angle of the sample pixels in view, None when there is no sample in view
+        self.sample_dist = None # Mean distance of the sample pixels in view
+        self.sample_pos = None # Position of the sample in view on the worldmap
+        self.rocks = RockTracker() # World positions of the rocks seen so far
+        self.rock_pursuit_dist = 10 # Go back for known rocks out of view closer than this (m)
+        self.rock_reach_dist = 1 # A known rock not found this close to it was a false detection (m)
+        self.speed_check = 0  # watchdog to find if we are stuck (seconds without moving)
+        self.watchdog_time = None  # total_time when the watchdog was last updated
+        self.stuck_time = 1.5  # seconds without moving to consider the rover stuck
+        self.unstuck_time = 3  # seconds to try turning in place before moving again
+        self.pick_up_samples = True  # value to make the rover pickup the samples
+        self.perception_context = PerceptionContext(self.vision_image.shape) # Precomputed warp and mask
+        self.map_stats = MapStats(self.ground_truth) # Mapped % and fidelity
+        self.quality = AdaptiveQuality() # Perception quality level, lowered when frames go over budget (off by default)
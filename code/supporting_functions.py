@@ -1,17 +1,28 @@
 import numpy as np
 import cv2
-from PIL import Image
-from io import BytesIO, StringIO
+from io import BytesIO
 import base64
 import time
+import logging
+import contextlib
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
 
 # Define a function to convert telemetry strings to float independent of decimal convention
 def convert_to_float(string_to_convert):
-      if ',' in string_to_convert:
-            float_value = np.float(string_to_convert.replace(',','.'))
-      else:
-            float_value = np.float(string_to_convert)
-      return float_value
+      return float(string_to_convert.replace(',', '.'))
+
+# Telemetry fields read on every message: (telemetry key, Rover attribute, parser)
+TELEMETRY_FIELDS = (('speed', 'vel', convert_to_float),  # The current speed of the rover in m/s
+                    ('yaw', 'yaw', convert_to_float),  # The current yaw angle of the rover
+                    ('pitch', 'pitch', convert_to_float),  # The current pitch angle of the rover
+                    ('roll', 'roll', convert_to_float),  # The current roll angle of the rover
+                    ('throttle', 'throttle', convert_to_float),  # The current throttle setting
+                    ('steering_angle', 'steer', convert_to_float),  # The current steering angle
+                    ('near_sample', 'near_sample', int),  # Near sample flag
+                    ('picking_up', 'picking_up', int))  # Picking up flag
 
 def update_rover(Rover, data):
       # Initialize start time and sample positions
@@ -21,109 +32,72 @@ def update_rover(Rover, data):
             samples_xpos = np.int_([convert_to_float(pos.strip()) for pos in data["samples_x"].split(';')])
             samples_ypos = np.int_([convert_to_float(pos.strip()) for pos in data["samples_y"].split(';')])
             Rover.samples_pos = (samples_xpos, samples_ypos)
-            Rover.samples_to_find = np.int(data["sample_count"])
+            Rover.samples_to_find = int(data["sample_count"])
       # Or just update elapsed time
       else:
             tot_time = time.time() - Rover.start_time
             if np.isfinite(tot_time):
                   Rover.total_time = tot_time
       # Print out the fields in the telemetry data dictionary
-      print(data.keys())
-      # The current speed of the rover in m/s
-      Rover.vel = convert_to_float(data["speed"])
+      debug = logger.isEnabledFor(logging.DEBUG)
+      if debug:
+            logger.debug('telemetry fields: %s', list(data.keys()))
+      for key, attribute, parse in TELEMETRY_FIELDS:
+            setattr(Rover, attribute, parse(data[key]))
       # The current position of the rover
-      Rover.pos = [convert_to_float(pos.strip()) for pos in data["position"].split(';')]
-      # The current yaw angle of the rover
-      Rover.yaw = convert_to_float(data["yaw"])
-      # The current yaw angle of the rover
-      Rover.pitch = convert_to_float(data["pitch"])
-      # The current yaw angle of the rover
-      Rover.roll = convert_to_float(data["roll"])
-      # The current throttle setting
-      Rover.throttle = convert_to_float(data["throttle"])
-      # The current steering angle
-      Rover.steer = convert_to_float(data["steering_angle"])
-      # Near sample flag
-      Rover.near_sample = np.int(data["near_sample"])
-      # Picking up flag
-      Rover.picking_up = np.int(data["picking_up"])
+      Rover.pos = [convert_to_float(pos) for pos in data["position"].split(';')]
       # Update number of rocks found
-      Rover.samples_found = Rover.samples_to_find - np.int(data["sample_count"])
-
-      print('speed =',Rover.vel, 'position =', Rover.pos, 'throttle =', 
-      Rover.throttle, 'steer_angle =', Rover.steer, 'near_sample:', Rover.near_sample, 
-      'picking_up:', data["picking_up"], 'sending pickup:', Rover.send_pickup, 
-      'total time:', Rover.total_time, 'samples remaining:', data["sample_count"], 
-      'samples found:', Rover.samples_found)
-      # Get the current image from the center camera of the rover
-      imgString = data["image"]
-      image = Image.open(BytesIO(base64.b64decode(imgString)))
-      Rover.img = np.asarray(image)
-
-      # Return updated Rover and separate image for optional saving
+      Rover.samples_found = Rover.samples_to_find - int(data["sample_count"])
+
+      if debug:
+            logger.debug('speed = %s position = %s throttle = %s steer_angle = %s near_sample: %s '
+                         'picking_up: %s sending pickup: %s total time: %s samples remaining: %s '
+                         'samples found: %s', Rover.vel, Rover.pos, Rover.throttle, Rover.steer,
+                         Rover.near_sample, data["picking_up"], Rover.send_pickup, Rover.total_time,
+                         data["sample_count"], Rover.samples_found)
+      # Get the current image from the center camera of the rover.
+      # cv2 decodes straight from the JPEG bytes, and the RGB image is written
+      # into the previous frame's buffer when there is one
+      image = base64.b64decode(data["image"])
+      bgr_img = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_COLOR)
+      if (isinstance(Rover.img, np.ndarray) and Rover.img.shape == bgr_img.shape
+          and Rover.img.flags.writeable):
+            cv2.cvtColor(bgr_img, cv2.COLOR_BGR2RGB, dst=Rover.img)
+      else:
+            Rover.img = cv2.cvtColor(bgr_img, cv2.COLOR_BGR2RGB)
+
+      # Return updated Rover and the JPEG bytes of the image for optional saving
       return Rover, image
 
 # Define a function to create display output given worldmap results
 def create_output_images(Rover):
 
-      # Create a scaled map for plotting and clean up obs/nav pixels a bit
-      if np.max(Rover.worldmap[:,:,2]) > 0:
-            nav_pix = Rover.worldmap[:,:,2] > 0
-            navigable = Rover.worldmap[:,:,2] * (255 / np.mean(Rover.worldmap[nav_pix, 2]))
-      else: 
-            navigable = Rover.worldmap[:,:,2]
-      if np.max(Rover.worldmap[:,:,0]) > 0:
-            obs_pix = Rover.worldmap[:,:,0] > 0
-            obstacle = Rover.worldmap[:,:,0] * (255 / np.mean(Rover.worldmap[obs_pix, 0]))
-      else:
-            obstacle = Rover.worldmap[:,:,0]
-
-      likely_nav = navigable >= obstacle
-      obstacle[likely_nav] = 0
-      plotmap = np.zeros_like(Rover.worldmap)
-      plotmap[:, :, 0] = obstacle
-      plotmap[:, :, 2] = navigable
-      plotmap = plotmap.clip(0, 255)
-      # Overlay obstacle and navigable terrain map with ground truth map
-      map_add = cv2.addWeighted(plotmap, 1, Rover.ground_truth, 0.5, 0)
-
-      # Check whether any rock detections are present in worldmap
-      rock_world_pos = Rover.worldmap[:,:,1].nonzero()
-      # If there are, we'll step through the known sample positions
-      # to confirm whether detections are real
-      if rock_world_pos[0].any():
-            rock_size = 2
-            for idx in range(len(Rover.samples_pos[0])):
-                  test_rock_x = Rover.samples_pos[0][idx]
-                  test_rock_y = Rover.samples_pos[1][idx]
-                  rock_sample_dists = np.sqrt((test_rock_x - rock_world_pos[1])**2 + \
-                                        (test_rock_y - rock_world_pos[0])**2)
-                  # If rocks were detected within 3 meters of known sample positions
-                  # consider it a success and plot the location of the known
-                  # sample on the map
-                  if np.min(rock_sample_dists) < 3:
+      # Map statistics are kept up to date by perception_step
+      stats = Rover.map_stats
+      # The obstacle and navigable channels already hold the classified cells of the occupancy grid,
+      # shaded by certainty. Overlay them with the ground truth map
+      map_add = stats.ground_truth_overlay.copy()
+      map_add[:, :, 0] += Rover.worldmap[:, :, 0]
+      map_add[:, :, 2] += Rover.worldmap[:, :, 2]
+
+      # Plot the known sample positions that have a tracked rock within 3 meters,
+      # those detections are considered a success
+      rock_size = 2
+      found = Rover.rocks.found()
+      if len(found) > 0:
+            for test_rock_x, test_rock_y in zip(*Rover.samples_pos):
+                  if np.min(np.hypot(found[:, 0] - test_rock_x, found[:, 1] - test_rock_y)) < 3:
                         map_add[test_rock_y-rock_size:test_rock_y+rock_size, 
                         test_rock_x-rock_size:test_rock_x+rock_size, :] = 255
 
       # Calculate some statistics on the map results
-      # First get the total number of pixels in the navigable terrain map
-      tot_nav_pix = np.float(len((plotmap[:,:,2].nonzero()[0])))
-      # Next figure out how many of those correspond to ground truth pixels
-      good_nav_pix = np.float(len(((plotmap[:,:,2] > 0) & (Rover.ground_truth[:,:,1] > 0)).nonzero()[0]))
-      # Next find how many do not correspond to ground truth pixels
-      bad_nav_pix = np.float(len(((plotmap[:,:,2] > 0) & (Rover.ground_truth[:,:,1] == 0)).nonzero()[0]))
-      # Grab the total number of map pixels
-      tot_map_pix = np.float(len((Rover.ground_truth[:,:,1].nonzero()[0])))
-      # Calculate the percentage of ground truth map that has been successfully found
-      perc_mapped = round(100*good_nav_pix/tot_map_pix, 1)
-      # Calculate the number of good map pixel detections divided by total pixels 
-      # found to be navigable terrain
-      if tot_nav_pix > 0:
-            fidelity = round(100*good_nav_pix/(tot_nav_pix), 1)
-      else:
-            fidelity = 0
-      # Flip the map for plotting so that the y-axis points upward in the display
-      map_add = np.flipud(map_add).astype(np.float32)
+      # Percentage of ground truth map that has been successfully found
+      perc_mapped = stats.perc_mapped()
+      # Number of good map pixel detections divided by total pixels found to be navigable terrain
+      fidelity = stats.fidelity()
+      # Flip the map for plotting so that the y-axis points upward in the display.
+      # Text is drawn on the 8 bit image that is encoded (OpenCV 5 only draws text on 8 bit images)
+      map_add = np.flipud(map_add).astype(np.uint8)
       # Add some text about map and rock sample detection results
       cv2.putText(map_add,"Time: "+str(np.round(Rover.total_time, 1))+' s', (0, 10), 
                   cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
@@ -134,8 +108,10 @@ def create_output_images(Rover):
       cv2.putText(map_add,"Rocks Found: "+str(Rover.samples_found), (0, 55), 
                   cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
 
-      # Convert map and vision image to base64 strings for sending to server
-      pil_img = Image.fromarray(map_add.astype(np.uint8))
+      # Convert map and vision image to base64 strings for sending to server.
+      # PIL is only needed here, so it is imported on the first rendering instead of at startup
+      from PIL import Image
+      pil_img = Image.fromarray(map_add)
       buff = BytesIO()
       pil_img.save(buff, format="JPEG")
       encoded_string1 = base64.b64encode(buff.getvalue()).decode("utf-8")
@@ -148,4 +124,56 @@ def create_output_images(Rover):
       return encoded_string1, encoded_string2
 
 
+# Copy of the parts of the rover state that create_output_images reads,
+# so images can be rendered while the rover state keeps changing
+def output_snapshot(Rover):
+      return SimpleNamespace(worldmap=Rover.worldmap.copy(),
+                             vision_image=Rover.vision_image.copy(),
+                             map_stats=Rover.map_stats.snapshot(),
+                             samples_pos=Rover.samples_pos,
+                             rocks=Rover.rocks.snapshot(),
+                             total_time=Rover.total_time,
+                             samples_found=Rover.samples_found)
+
+# Render and encode the inset images in a background thread so sending commands
+# never waits for them. A new rendering starts at most every `every_n_frames` frames
+# and `max_hz` times per second, and only when the previous one is finished.
+# In between, the most recent encoded images are reused
+class InsetRenderer():
+      def __init__(self, every_n_frames=1, max_hz=10, stats=None, profiler=None):
+            self.every_n_frames = every_n_frames
+            # Optional PipelineStats to record the time spent rendering
+            self.stats = stats
+            # Optional FrameProfiler to profile rendering (as scope 'output')
+            self.profiler = profiler
+            self.min_interval = 1 / max_hz if max_hz > 0 else 0
+            self.executor = ThreadPoolExecutor(max_workers=1)
+            self.pending = None
+            self.images = ('', '')
+            self.frames_since_render = 0
+            self.last_render = 0
+
+      # Returns the most recent (map, vision) encoded images
+      def update(self, Rover):
+            if self.pending is not None and self.pending.done():
+                  self.images = self.pending.result()
+                  self.pending = None
+            self.frames_since_render += 1
+            now = time.time()
+            if (self.pending is None and self.frames_since_render >= self.every_n_frames
+                and now - self.last_render >= self.min_interval):
+                  self.pending = self.executor.submit(self.render, output_snapshot(Rover))
+                  self.frames_since_render = 0
+                  self.last_render = now
+            return self.images
+
+      def render(self, snapshot):
+            with contextlib.ExitStack() as scopes:
+                  if self.stats is not None:
+                        scopes.enter_context(self.stats.stage('output'))
+                  if self.profiler is not None:
+                        scopes.enter_context(self.profiler.scope('output'))
+                  return create_output_images(snapshot)
 
+      def shutdown(self):
+            self.executor.shutdown(wait=False)